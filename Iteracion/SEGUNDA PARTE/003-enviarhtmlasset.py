@@ -1,10 +1,14 @@
 import json
+import os
 import re
 import smtplib
 import ssl
 from email.message import EmailMessage
 from pathlib import Path
 
+# MAIL_DEBUG=1 -> imprime el tamaño total del email (serializa el MIME completo)
+_DEBUG = os.environ.get("MAIL_DEBUG") == "1"
+
 
 def load_config(path: str) -> dict:
     with open(path, "r", encoding="utf-8") as f:
@@ -16,6 +20,13 @@ def load_html_template(path: Path) -> str:
         return f.read()
 
 
+# Espacios alrededor de cada salto de línea (incluye líneas vacías enteras).
+# Mismos saltos que str.splitlines(): \n, \r, \v, \f, \x1c-\x1e, \x85, \u2028, \u2029
+_LINE_BREAKS = "\n\r\v\f\x1c-\x1e\x85\u2028\u2029"
+_LINE_BREAK_RE = re.compile(rf"[^\S{_LINE_BREAKS}]*[{_LINE_BREAKS}]\s*")
+_MULTI_WS_RE = re.compile(r"[ \t]{2,}")
+
+
 def minify_html_safe(html: str) -> str:
     """
     Minificado suave (seguro para emails):
@@ -23,9 +34,8 @@ def minify_html_safe(html: str) -> str:
     - Recorta espacios al inicio/fin de cada línea
     - Reduce múltiples espacios/tabulaciones a 1
     """
-    lines = [line.strip() for line in html.splitlines() if line.strip()]
-    html = "\n".join(lines)
-    html = re.sub(r"[ \t]{2,}", " ", html)
+    html = _LINE_BREAK_RE.sub("\n", html).strip()
+    html = _MULTI_WS_RE.sub(" ", html)
     return html
 
 
@@ -54,7 +64,8 @@ def create_message(cfg: dict) -> EmailMessage:
 
     # Debug útil (puedes borrarlo luego)
     print("HTML bytes:", len(html_final.encode("utf-8")))
-    print("Email total bytes:", len(msg.as_bytes()))
+    if _DEBUG:
+        print("Email total bytes:", len(msg.as_bytes()))
 
     return msg
 
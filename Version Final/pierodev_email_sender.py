@@ -19,7 +19,11 @@
 #
 #  Arquitectura:
 #   - create_message_for_recipient() construye el EmailMessage completo
-#   - send_now() envía por SMTP
+#       * build_template_message(): adjuntos + vCard (una vez, memoizado)
+#       * build_shared_payload(): plantilla + QR + CIDs (una vez por lote)
+#       * assemble_message(): headers, texto, PS y theme de cada destinatario
+#   - SmtpSender mantiene UNA conexión SMTP para todo el lote
+#   - send_now() envía por SMTP (send_bulk() en paralelo con K conexiones)
 #   - schedule_only() encola jobs (para un worker separado)
 #
 #  Importante:
@@ -27,18 +31,49 @@
 #   - Si falta qrcode o tzdata, el script NO revienta (tiene fallbacks)
 # ============================================================
 
+import atexit
+import base64
 import json
+import mmap
+import os
+import re
 import smtplib
 import ssl
 import mimetypes
 import random
 import hashlib
+import itertools
+import secrets
+import threading
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from functools import cache, lru_cache
+from email import policy as email_policy
+from email.generator import BytesGenerator
 from email.message import EmailMessage
-from email.utils import make_msgid
+from email.utils import getaddresses, make_msgid
+from io import BytesIO
 from pathlib import Path
 from datetime import datetime
+from html import escape as html_escape
 
-from bs4 import BeautifulSoup  # pip install beautifulsoup4
+from bs4 import BeautifulSoup, SoupStrainer  # pip install beautifulsoup4
+
+
+# ------------------------------------------------------------
+# Parser HTML para BeautifulSoup (pip install lxml)
+# - lxml es un parser en C: bastante más rápido que "html.parser"
+#   (que es Python puro) al construir el árbol de la plantilla.
+# - Si no está instalado, NO reventamos: usamos "html.parser".
+# - Con lxml, el fallback de <img> usa XPath directo (sin objetos Tag de bs4).
+# ------------------------------------------------------------
+try:
+    from lxml import html as lxml_html
+    HTML_PARSER = "lxml"
+except ImportError:
+    lxml_html = None
+    HTML_PARSER = "html.parser"
 
 
 # ------------------------------------------------------------
@@ -64,6 +99,37 @@ except ImportError:
     qrcode = None
 
 
+# ------------------------------------------------------------
+# JSON rápido (pip install orjson)
+# - orjson es una extensión en C, más rápida que json para parsear
+#   y serializar (config y queue.json).
+# - Si no está instalado, usamos json de la stdlib.
+# ------------------------------------------------------------
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def _json_loads(data: bytes):
+    """Parsea JSON desde bytes (orjson si está, si no json)."""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def _json_dumps(obj, pretty: bool = True) -> bytes:
+    """
+    Serializa a bytes UTF-8 (mismo formato que json.dump(..., ensure_ascii=False, indent=2)).
+    """
+    if orjson is not None:
+        option = orjson.OPT_NON_STR_KEYS
+        if pretty:
+            option |= orjson.OPT_INDENT_2
+        return orjson.dumps(obj, option=option)
+    return json.dumps(obj, ensure_ascii=False, indent=2 if pretty else None).encode("utf-8")
+
+
 # ============================================================
 # BASE DIR
 # - Carpeta donde está este script.
@@ -73,10 +139,54 @@ except ImportError:
 BASE_DIR = Path(__file__).resolve().parent
 
 
+@lru_cache(maxsize=None)
+def resolve_under_base(path_str: str) -> Path:
+    """
+    Ruta ABSOLUTA para un path de config: si es relativo, contra BASE_DIR.
+
+    Cacheado por string: resolve() hace syscalls (stat/realpath) y estas
+    rutas (log, cola, estado, plantilla) se piden en cada correo.
+    """
+    p = Path(path_str)
+    if not p.is_absolute():
+        p = BASE_DIR / p
+    return p.resolve()
+
+
+# Carpetas que ya creamos/vimos (mkdir solo la primera vez)
+_ENSURED_DIRS: set[Path] = set()
+
+
+def ensure_dir(path: Path) -> None:
+    """
+    mkdir(parents=True, exist_ok=True) una sola vez por carpeta y proceso.
+
+    Nota:
+      - Si ya está en _ENSURED_DIRS se comprueba con 1 stat que siga
+        existiendo (p.ej. alguien borró generated/ con el worker en marcha);
+        si no, se quita del set y se vuelve a crear.
+    """
+    if path in _ENSURED_DIRS:
+        if os.path.isdir(path):
+            return
+        _ENSURED_DIRS.discard(path)
+    path.mkdir(parents=True, exist_ok=True)
+    _ENSURED_DIRS.add(path)
+
+
 # ============================================================
 # 1) Carga de config y plantilla HTML
 # ============================================================
 
+@lru_cache(maxsize=32)
+def _cached_load_config(path_str: str, mtime_ns: int) -> dict:
+    """
+    Parsea el JSON de config. Cacheado por (ruta, mtime):
+    si el archivo no cambió, no se vuelve a leer ni a parsear.
+    """
+    return _json_loads(Path(path_str).read_bytes())
+
+
 def load_config(path: str | Path) -> dict:
     """
     Lee un archivo JSON y devuelve el config como dict.
@@ -90,10 +200,17 @@ def load_config(path: str | Path) -> dict:
     Nota:
       - Se asume que el JSON es válido.
       - Si el archivo no existe, el error lo maneja el caller.
+      - Cacheado por (ruta, mtime): el dict devuelto es el MISMO objeto
+        entre llamadas, así que no lo modifiques de forma permanente.
     """
     path = Path(path)
-    with open(path, "r", encoding="utf-8") as f:
-        return json.load(f)
+    return _cached_load_config(str(path), path.stat().st_mtime_ns)
+
+
+@lru_cache(maxsize=32)
+def _cached_load_html_template(path_str: str, mtime_ns: int) -> str:
+    """Lee la plantilla HTML. Cacheado por (ruta, mtime)."""
+    return Path(path_str).read_text(encoding="utf-8")
 
 
 def load_html_template(path: str | Path) -> str:
@@ -105,10 +222,13 @@ def load_html_template(path: str | Path) -> str:
 
     Retorna:
       str: contenido completo del HTML.
+
+    Nota:
+      - Cacheado por (ruta, mtime): en un envío a N destinatarios
+        la plantilla se lee de disco una sola vez.
     """
     path = Path(path)
-    with open(path, "r", encoding="utf-8") as f:
-        return f.read()
+    return _cached_load_html_template(str(path), path.stat().st_mtime_ns)
 
 
 # ============================================================
@@ -127,43 +247,128 @@ def get_log_path(cfg: dict) -> Path:
     """
     email_cfg = cfg.get("email", {})
     log_file = email_cfg.get("log_file", "sent_emails.log")
+    return resolve_under_base(str(log_file))
 
-    p = Path(log_file)
-    if not p.is_absolute():
-        p = BASE_DIR / p
 
-    return p.resolve()
+# Buffer del log:
+# - Antes se hacía open/write/close por cada correo.
+# - Ahora el archivo se abre una vez y las líneas se escriben por lotes.
+_LOG_BUFFER: list[str] = []
+_LOG_HANDLE = None
+_LOG_PATH: Path | None = None
+
+
+def _ensure_log_open(log_path: Path):
+    """
+    Abre (una sola vez) el archivo de log en modo append.
+
+    Si cambia el log_path, cierra el anterior y abre el nuevo.
+    """
+    global _LOG_HANDLE, _LOG_PATH
+
+    if _LOG_HANDLE is not None and _LOG_PATH == log_path:
+        return _LOG_HANDLE
+
+    if _LOG_HANDLE is not None:
+        _LOG_HANDLE.close()
+        _LOG_HANDLE = None
+
+    ensure_dir(log_path.parent)
+    _LOG_HANDLE = open(log_path, "a", encoding="utf-8", buffering=1 << 16)
+    _LOG_PATH = log_path
+    return _LOG_HANDLE
+
+
+def flush_log() -> None:
+    """
+    Escribe en disco las líneas pendientes del buffer de log.
+
+    Se llama:
+      - cuando el buffer llega a email.log_buffer_size líneas
+      - al salir del proceso (atexit)
+      - desde el worker al final de cada ciclo
+
+    Nota:
+      - Si falla el log, no reventamos el script: solo WARN.
+    """
+    if not _LOG_BUFFER or _LOG_PATH is None:
+        return
+
+    try:
+        f = _ensure_log_open(_LOG_PATH)
+        f.write("".join(_LOG_BUFFER))
+        f.flush()
+    except Exception as e:
+        print(f"[WARN] Could not write log file {_LOG_PATH}: {e}")
+    finally:
+        _LOG_BUFFER.clear()
+
+
+atexit.register(flush_log)
+
+
+def _fmt_ts(dt: datetime) -> str:
+    """"YYYY-MM-DD HH:MM:SS" con f-string (más barato que strftime)."""
+    return f"{dt.year:04d}-{dt.month:02d}-{dt.day:02d} {dt.hour:02d}:{dt.minute:02d}:{dt.second:02d}"
+
+
+def _fmt_ts_compact(dt: datetime) -> str:
+    """"YYYYMMDDHHMMSS" con f-string (para ids de job)."""
+    return f"{dt.year:04d}{dt.month:02d}{dt.day:02d}{dt.hour:02d}{dt.minute:02d}{dt.second:02d}"
+
+
+# Timestamp del log ya formateado: [segundo_epoch, "YYYY-MM-DD HH:MM:SS"]
+# - Solo se formatea cuando cambia el segundo.
+_TS_CACHE: list = [0, ""]
+
+
+def _log_timestamp() -> str:
+    """
+    Devuelve la hora local actual como "YYYY-MM-DD HH:MM:SS".
+
+    Nota:
+      - Las líneas escritas en el mismo segundo reutilizan el texto cacheado.
+    """
+    now = int(time.time())
+    if now != _TS_CACHE[0]:
+        _TS_CACHE[:] = [now, _fmt_ts(datetime.fromtimestamp(now))]
+    return _TS_CACHE[1]
 
 
 def log_email_result(cfg: dict, to_addr: str, subject: str, success: bool, message: str = "") -> None:
     """
-    Escribe una línea en el log indicando resultado del envío.
+    Añade una línea al log indicando resultado del envío.
 
     Formato:
       YYYY-MM-DD HH:MM:SS ; destino ; subject ; OK/ERROR ; info
 
     Parámetros:
-      cfg (dict): config para resolver log_file
+      cfg (dict): config para resolver log_file y log_buffer_size
       to_addr (str): destinatario
       subject (str): asunto
       success (bool): True=OK, False=ERROR
       message (str): texto adicional (PS, theme, error, etc.)
 
     Nota:
-      - Si falla el log, no reventamos el script: solo WARN.
+      - La línea va a un buffer en memoria; se escribe al llegar a
+        cfg["email"]["log_buffer_size"] líneas (default 64) o al salir.
     """
+    global _LOG_PATH
+
     log_path = get_log_path(cfg)
-    log_path.parent.mkdir(parents=True, exist_ok=True)
+    if log_path != _LOG_PATH:
+        # Cambió el archivo destino: vaciamos lo pendiente del anterior
+        flush_log()
+        _LOG_PATH = log_path
 
-    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    timestamp = _log_timestamp()
     status = "OK" if success else "ERROR"
     line = f"{timestamp} ; {to_addr} ; {subject} ; {status} ; {message}\n"
+    _LOG_BUFFER.append(line)
 
-    try:
-        with open(log_path, "a", encoding="utf-8") as f:
-            f.write(line)
-    except Exception as e:
-        print(f"[WARN] Could not write log file {log_path}: {e}")
+    buffer_size = int(cfg.get("email", {}).get("log_buffer_size", 64))
+    if len(_LOG_BUFFER) >= buffer_size:
+        flush_log()
 
 
 # ============================================================
@@ -178,6 +383,7 @@ def get_app_cfg(cfg: dict) -> dict:
     return cfg.get("app", {})
 
 
+@lru_cache(maxsize=8)
 def safe_tz(tz_name: str):
     """
     Intenta devolver ZoneInfo(tz_name). Si no se puede, devuelve None.
@@ -187,6 +393,10 @@ def safe_tz(tz_name: str):
       - tzdata no instalado / zona no encontrada -> None
 
     Esto evita que el script reviente solo por timezone.
+
+    Nota:
+      - Cacheado por nombre, también cuando falla: una zona inválida no
+        vuelve a lanzar/capturar la excepción en cada llamada.
     """
     if ZoneInfo is None:
         return None
@@ -223,15 +433,68 @@ def get_queue_path(cfg: dict) -> Path:
       -> BASE_DIR/queue.json
     """
     qfile = get_app_cfg(cfg).get("queue_file", "queue.json")
-    p = Path(qfile)
-    if not p.is_absolute():
-        p = BASE_DIR / p
-    return p.resolve()
+    return resolve_under_base(str(qfile))
+
+
+def get_queue_log_path(queue_path: Path) -> Path:
+    """
+    Archivo append-only de la cola: queue.json -> queue.jsonl
+
+    Formato:
+      - 1 job por línea (JSON compacto)
+      - schedule_only() solo AÑADE líneas aquí (no reescribe queue.json)
+    """
+    return Path(queue_path).with_suffix(".jsonl")
+
+
+def read_queue_file(qp: Path) -> dict:
+    """
+    Carga la cola completa desde qp (queue.json) + su queue.jsonl.
+
+    Reglas:
+      - Si no existe ninguno -> {"jobs": []}
+      - Los jobs de queue.jsonl se añaden al final, en orden.
+      - Si un id ya está en queue.json, gana queue.json (tiene el
+        status actualizado por el worker).
+      - Una última línea a medias (corte mientras se escribía) se ignora.
+    """
+    qp = Path(qp)
+    # EAFP: leer y capturar FileNotFoundError (1 syscall en vez de exists + open)
+    try:
+        data = _json_loads(qp.read_bytes())
+    except FileNotFoundError:
+        data = {"jobs": []}
+
+    try:
+        log_bytes = get_queue_log_path(qp).read_bytes()
+    except FileNotFoundError:
+        return data
+
+    jobs = data.get("jobs")
+    if not isinstance(jobs, list):
+        jobs = data["jobs"] = []
+    known_ids = {j.get("id") for j in jobs if isinstance(j, dict)}
+
+    for line in log_bytes.splitlines():
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            job = _json_loads(line)
+        except ValueError:
+            print(f"[WARN] Línea inválida en {get_queue_log_path(qp).name}, se ignora")
+            continue
+        if job.get("id") in known_ids:
+            continue
+        known_ids.add(job.get("id"))
+        jobs.append(job)
+
+    return data
 
 
 def load_queue(cfg: dict) -> dict:
     """
-    Carga queue.json y devuelve dict.
+    Carga queue.json (+ queue.jsonl) y devuelve dict.
 
     Si no existe:
       devuelve {"jobs": []}
@@ -239,27 +502,113 @@ def load_queue(cfg: dict) -> dict:
     Nota:
       - schedule_only() usa esto para no depender de que exista la cola.
     """
-    qp = get_queue_path(cfg)
-    if not qp.exists():
-        return {"jobs": []}
-    with open(qp, "r", encoding="utf-8") as f:
-        return json.load(f)
+    return read_queue_file(get_queue_path(cfg))
 
 
-def save_queue(cfg: dict, queue_data: dict) -> None:
+def open_for_append(path: Path):
+    """
+    Abre un archivo de 1 registro por línea (queue.jsonl, queue.journal)
+    para añadir al final.
+
+    Si la última línea quedó a medias (proceso cortado mientras escribía),
+    antes se cierra con un "\n": si no, el 1er registro nuevo se pegaría a
+    ella y al leer se descartarían los dos. La línea rota se ignora sola.
+
+    Retorna:
+      archivo abierto en modo "a+b" (las escrituras siempre van al final)
+    """
+    f = open(path, "a+b")
+    if f.tell() > 0:
+        f.seek(-1, os.SEEK_END)
+        if f.read(1) != b"\n":
+            f.write(b"\n")
+    return f
+
+
+def append_jobs(cfg: dict, jobs: list[dict]) -> int:
+    """
+    Añade jobs al final de queue.jsonl (1 línea por job) con UN fsync.
+
+    Coste O(N) en los jobs nuevos, sin leer ni reescribir la cola existente.
+
+    Retorna:
+      int: número APROXIMADO de líneas de queue.jsonl
+        (tamaño del archivo / tamaño medio de las líneas nuevas; sin releerlo)
+    """
+    log_path = get_queue_log_path(get_queue_path(cfg))
+    ensure_dir(log_path.parent)
+
+    payload = b"".join(_json_dumps(job, pretty=False) + b"\n" for job in jobs)
+    with open_for_append(log_path) as f:
+        f.write(payload)
+        f.flush()
+        os.fsync(f.fileno())
+        size = f.tell()
+
+    if not payload:
+        return 0
+    return size * len(jobs) // len(payload)
+
+
+def compact_queue(cfg: dict) -> None:
     """
-    Guarda queue.json de manera segura (tmp -> replace).
+    Vuelca queue.jsonl dentro de queue.json y borra el .jsonl.
 
-    Esto reduce la probabilidad de que quede un JSON corrupto
-    si el proceso se corta mientras escribe.
+    Se llama cuando el .jsonl supera app.queue_compact_lines (default 1000).
     """
     qp = get_queue_path(cfg)
-    qp.parent.mkdir(parents=True, exist_ok=True)
+    save_queue(cfg, read_queue_file(qp))
+    get_queue_log_path(qp).unlink(missing_ok=True)
+    print(f"[INFO] Cola compactada en: {qp}")
+
+
+def atomic_write_bytes(path: Path, payload: bytes) -> None:
+    """
+    Escribe un archivo de forma atómica Y durable:
+
+      1) escribe en <path>.tmp + fsync (los datos llegan al disco)
+      2) os.replace(tmp, path) (rename atómico)
+      3) fsync de la carpeta (el rename también queda en disco)
+
+    Sin los fsync, el rename es atómico pero un corte de luz puede
+    dejar el archivo vacío o perder la cola entera.
+
+    Nota:
+      - En Windows no se puede abrir una carpeta con os.open
+        (no hay O_DIRECTORY): ese paso se omite.
+    """
+    path = Path(path)
+    ensure_dir(path.parent)
+    tmp = path.with_suffix(".tmp")
+
+    fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC | getattr(os, "O_BINARY", 0), 0o644)
+    try:
+        # os.write puede escribir solo una parte: seguimos hasta el final
+        view = memoryview(payload)
+        while view:
+            view = view[os.write(fd, view):]
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+    os.replace(tmp, path)
+
+    if hasattr(os, "O_DIRECTORY"):
+        dfd = os.open(str(path.parent), os.O_DIRECTORY)
+        try:
+            os.fsync(dfd)
+        finally:
+            os.close(dfd)
+
+
+def save_queue(cfg: dict, queue_data: dict) -> None:
+    """
+    Guarda queue.json de manera segura (tmp + fsync -> replace).
 
-    tmp = qp.with_suffix(".tmp")
-    with open(tmp, "w", encoding="utf-8") as f:
-        json.dump(queue_data, f, ensure_ascii=False, indent=2)
-    tmp.replace(qp)
+    Esto evita que quede un JSON corrupto (o se pierda la cola)
+    si el proceso o la máquina se cortan mientras escribe.
+    """
+    atomic_write_bytes(get_queue_path(cfg), _json_dumps(queue_data))
 
 
 def parse_scheduled_for(cfg: dict) -> str:
@@ -294,20 +643,26 @@ def parse_scheduled_for(cfg: dict) -> str:
     return dt.isoformat()
 
 
+# Contador por proceso: ids únicos aunque se encolen muchos en el mismo segundo
+_JOB_COUNTER = itertools.count(1)
+
+
 def new_job_id() -> str:
     """
-    Genera un ID simple para cada job en la cola.
+    Genera un ID para cada job en la cola.
 
     Formato:
-      job_YYYYMMDDHHMMSS_RAND
+      job_YYYYMMDDHHMMSS_NNNN_xxxx
+
+      - NNNN: contador del proceso (no se repite dentro del mismo lote)
+      - xxxx: 2 bytes aleatorios (secrets) para distinguir procesos distintos
 
     Nota:
-      - Suficiente para una cola local.
-      - No es UUID, pero evita colisiones “normales”.
+      - Antes era job_<ts>_<randint 1000-9999>: con ~100 jobs en el
+        mismo segundo había opciones reales de id repetido.
     """
-    ts = datetime.now().strftime("%Y%m%d%H%M%S")
-    rnd = random.randint(1000, 9999)
-    return f"job_{ts}_{rnd}"
+    ts = _fmt_ts_compact(datetime.now())
+    return f"job_{ts}_{next(_JOB_COUNTER):04d}_{secrets.token_hex(2)}"
 
 
 def get_recipients(cfg: dict) -> list[str]:
@@ -375,10 +730,7 @@ def get_templates_state_path(cfg: dict) -> Path:
     """
     tcfg = get_templates_cfg(cfg)
     state_file = tcfg.get("state_file", "templates_state.json")
-    p = Path(state_file)
-    if not p.is_absolute():
-        p = BASE_DIR / p
-    return p.resolve()
+    return resolve_under_base(str(state_file))
 
 
 def load_templates_state(cfg: dict) -> dict:
@@ -392,12 +744,8 @@ def load_templates_state(cfg: dict) -> dict:
       - índice a usar en el próximo correo (round_robin).
     """
     sp = get_templates_state_path(cfg)
-    if not sp.exists():
-        return {"rr_next": 0}
-
     try:
-        with open(sp, "r", encoding="utf-8") as f:
-            data = json.load(f)
+        data = _json_loads(sp.read_bytes())
         if isinstance(data, dict):
             data.setdefault("rr_next", 0)
             return data
@@ -414,15 +762,67 @@ def save_templates_state(cfg: dict, state: dict) -> None:
     Así evitamos:
       - archivos a medias si se corta el proceso.
     """
-    sp = get_templates_state_path(cfg)
-    sp.parent.mkdir(parents=True, exist_ok=True)
+    _write_templates_state(get_templates_state_path(cfg), state)
+
+
+def _write_templates_state(sp: Path, state: dict) -> None:
+    """Escritura tmp -> replace de templates_state.json en la ruta dada."""
+    ensure_dir(sp.parent)
 
     tmp = sp.with_suffix(".tmp")
-    with open(tmp, "w", encoding="utf-8") as f:
-        json.dump(state, f, ensure_ascii=False, indent=2)
+    tmp.write_bytes(_json_dumps(state))
     tmp.replace(sp)
 
 
+# Estado round_robin en memoria:
+# - Antes: leer + reescribir templates_state.json en CADA correo.
+# - Ahora: se lee una vez, rr_next avanza en memoria y se guarda
+#   una vez por lote (flush_templates_state) o al salir.
+_RR_STATE: dict = {"path": None, "state": None, "dirty": False}
+
+# Protege el leer+avanzar+guardar de rr_next cuando hay varios hilos
+_THEME_LOCK = threading.Lock()
+
+
+def flush_templates_state() -> None:
+    """
+    Guarda en disco el rr_next pendiente (si cambió desde el último guardado).
+
+    Nota:
+      - send_now / send_bulk / schedule_only lo llaman al terminar.
+      - El worker lo llama en cada tick; también se registra en atexit.
+    """
+    with _THEME_LOCK:
+        if _RR_STATE["dirty"] and _RR_STATE["path"] is not None:
+            try:
+                _write_templates_state(_RR_STATE["path"], _RR_STATE["state"])
+            except Exception as e:
+                print(f"[WARN] No se pudo guardar templates_state: {e}")
+        _RR_STATE["dirty"] = False
+
+
+atexit.register(flush_templates_state)
+
+
+def _next_round_robin(cfg: dict, n: int) -> int:
+    """
+    Devuelve el índice round_robin actual y avanza rr_next (en memoria).
+    Debe llamarse con _THEME_LOCK tomado.
+    """
+    sp = get_templates_state_path(cfg)
+    if _RR_STATE["path"] != sp:
+        # Otra ruta de estado: guardamos la anterior y cargamos la nueva
+        if _RR_STATE["dirty"] and _RR_STATE["path"] is not None:
+            _write_templates_state(_RR_STATE["path"], _RR_STATE["state"])
+        _RR_STATE.update(path=sp, state=load_templates_state(cfg), dirty=False)
+
+    st = _RR_STATE["state"]
+    idx = int(st.get("rr_next", 0)) % n
+    st["rr_next"] = (idx + 1) % n
+    _RR_STATE["dirty"] = True
+    return idx
+
+
 def pick_theme_index(cfg: dict, recipient: str | None = None) -> int:
     """
     Elige qué theme usar según cfg["templates"]["strategy"]:
@@ -457,15 +857,14 @@ def pick_theme_index(cfg: dict, recipient: str | None = None) -> int:
         base = (recipient or "").strip().lower()
         if not base:
             return 0
-        h = hashlib.sha256(base.encode("utf-8")).hexdigest()
-        return int(h, 16) % n
+        # crc32 (C, 32 bits): reparto uniforme y estable entre ejecuciones
+        # (hash() de Python cambia con PYTHONHASHSEED; sha256 sobra aquí)
+        return zlib.crc32(base.encode("utf-8")) % n
 
     # round_robin (default)
-    st = load_templates_state(cfg)
-    idx = int(st.get("rr_next", 0)) % n
-    st["rr_next"] = (idx + 1) % n
-    save_templates_state(cfg, st)
-    return idx
+    # Lock: send_bulk construye mensajes desde varios hilos a la vez
+    with _THEME_LOCK:
+        return _next_round_robin(cfg, n)
 
 
 def resolve_theme(cfg: dict, recipient: str | None, theme_index_override: int | None = None):
@@ -524,21 +923,39 @@ def apply_theme_to_html(html: str, theme: dict | None) -> str:
       - Es un sistema simple pero potente: puedes cambiar colores y textos.
       - Si necesitas cambios estructurales, ahí ya sería “otra plantilla HTML”.
     """
-    if not theme:
-        return html
+    rep = theme.get("replace", {}) if theme else {}
+    if not isinstance(rep, dict):
+        rep = {}
 
-    rep = theme.get("replace", {})
-    if not isinstance(rep, dict) or not rep:
+    pairs = tuple(
+        (old, new) for old, new in rep.items()
+        if isinstance(old, str) and isinstance(new, str) and old and old != new
+    )
+    if not pairs:
         return html
 
-    for old, new in rep.items():
-        if not isinstance(old, str) or not isinstance(new, str):
-            continue
-        if not old or old == new:
-            continue
-        html = html.replace(old, new)
+    pattern, mapping = _theme_replacer(pairs)
+    return pattern.sub(lambda m: mapping[m.group(0)], html)
 
-    return html
+
+@lru_cache(maxsize=32)
+def _theme_replacer(pairs: tuple) -> tuple:
+    """
+    Compila los reemplazos de un theme en UNA regex (alternación).
+
+    Retorna:
+      (pattern, mapping) -> pattern.sub(...) hace todos los reemplazos
+      en una sola pasada sobre el HTML (antes: 1 copia del HTML por color).
+
+    Nota:
+      - Claves más largas primero: "#ffffff" gana a "#fff".
+      - Los reemplazos son simultáneos: el resultado de uno no se vuelve a
+        reemplazar con otro (con los themes actuales da lo mismo que antes).
+    """
+    mapping = dict(pairs)
+    keys = sorted(mapping, key=len, reverse=True)
+    pattern = re.compile("|".join(re.escape(k) for k in keys))
+    return pattern, mapping
 
 
 # ============================================================
@@ -557,20 +974,29 @@ def pick_random_ps(cfg: dict) -> str:
     Retorna:
       str (ej: "P.D.: ...") o "" si no aplica.
     """
+    return precompute_ps_lines(cfg, 1)[0]
+
+
+def precompute_ps_lines(cfg: dict, n: int) -> list[str]:
+    """
+    Elige de una vez los PS de n correos (random.choices con k=n).
+
+    Retorna:
+      list[str] de largo n (cada uno "P.D.: ..." o "" si no aplica).
+
+    Nota:
+      - La config de ps se lee una sola vez para todo el lote.
+    """
     ps_cfg = cfg.get("ps", {})
     if not ps_cfg.get("enabled", False):
-        return ""
+        return [""] * n
 
-    phrases = ps_cfg.get("phrases", [])
+    phrases = [str(p).strip() for p in ps_cfg.get("phrases", [])]
     if not phrases:
-        return ""
+        return [""] * n
 
     prefix = ps_cfg.get("prefix", "P.D.:")
-    phrase = random.choice(phrases).strip()
-    if not phrase:
-        return ""
-
-    return f"{prefix} {phrase}"
+    return [f"{prefix} {phrase}" if phrase else "" for phrase in random.choices(phrases, k=n)]
 
 
 def apply_ps_to_text(body_text: str, ps_line: str, cfg: dict) -> str:
@@ -591,7 +1017,7 @@ def apply_ps_to_text(body_text: str, ps_line: str, cfg: dict) -> str:
     return body_text + "\n\n" + ps_line
 
 
-def apply_ps_to_html(html: str, ps_line: str, cfg: dict) -> str:
+def apply_ps_to_html(html: str, ps_line: str, cfg: dict, theme: dict | None = None) -> str:
     """
     Inserta el PS en el HTML (si cfg["ps"]["add_to_html"] == True).
 
@@ -599,6 +1025,11 @@ def apply_ps_to_html(html: str, ps_line: str, cfg: dict) -> str:
       1) Si el HTML contiene {{PS}} -> reemplaza ese marcador.
       2) Si no contiene marcador -> inserta un <p> al final del <body>.
 
+    Parámetros:
+      theme (dict|None): theme del correo. El HTML ya viene con el theme
+        aplicado (ver themed_html_and_parts), así que aquí se aplica solo
+        al trozo insertado: igual que antes (PS y luego theme sobre todo).
+
     Ventaja:
       - No te obliga a editar la plantilla cada vez; funciona por defecto.
     """
@@ -610,11 +1041,12 @@ def apply_ps_to_html(html: str, ps_line: str, cfg: dict) -> str:
         return html
 
     if "{{PS}}" in html:
-        return html.replace("{{PS}}", ps_line)
+        return html.replace("{{PS}}", apply_theme_to_html(ps_line, theme))
 
-    soup = BeautifulSoup(html, "html.parser")
-    body = soup.body
-    if body is None:
+    # Inserción directa antes del último </body> (sin parsear la plantilla).
+    # Sin <body> no hay dónde insertar -> se devuelve tal cual.
+    idx = html.lower().rfind("</body>")
+    if idx == -1:
         return html
 
     style = ps_cfg.get(
@@ -624,18 +1056,23 @@ def apply_ps_to_html(html: str, ps_line: str, cfg: dict) -> str:
         "color:#334155; font-size:11px; line-height:16px;"
     )
 
-    p = soup.new_tag("p")
-    p["style"] = style
-    p.string = ps_line
-
-    body.append(p)
-    return str(soup)
+    # Escapamos el PS (y el style) por si alguna frase trae <, > o &
+    p_html = f'<p style="{html_escape(style)}">{html_escape(ps_line, quote=False)}</p>'
+    p_html = apply_theme_to_html(p_html, theme)
+    return html[:idx] + p_html + html[idx:]
 
 
 # ============================================================
 # 6) QR: generar PNG y reemplazar placeholder del HTML
 # ============================================================
 
+# QR ya listos en este proceso:
+#   (base_dir, output_dir, filename, url, box_size, border) -> (out_path, rel_src)
+# - A partir del 2º lote (p.ej. cada tick del worker) no se hace resolve()
+#   ni se lee el .png.key: basta comprobar que el PNG sigue existiendo.
+_QR_CACHE: dict[tuple, tuple[Path, str]] = {}
+
+
 def ensure_portfolio_qr(cfg: dict, html_base_dir: Path) -> str | None:
     """
     Genera un QR PNG a una URL (normalmente tu portafolio).
@@ -654,15 +1091,18 @@ def ensure_portfolio_qr(cfg: dict, html_base_dir: Path) -> str | None:
       str | None:
         - devuelve la ruta relativa (ej: "generated/qr_portfolio.png")
         - o None si no se pudo generar
+
+    Cache:
+      - Junto al PNG se guarda "<filename>.key" con un hash de
+        (url, box_size, border, error_correction). Si coincide, se
+        reutiliza el PNG existente.
+      - En lotes se llama 1 vez (build_shared_payload), no por destinatario.
+      - En memoria (_QR_CACHE): mismos parámetros -> 1 stat y listo.
     """
     qr_cfg = cfg.get("qr", {})
     if not qr_cfg.get("enabled", False):
         return None
 
-    if qrcode is None:
-        print("[WARN] QR enabled pero falta 'qrcode'. Instala: pip install qrcode[pil]")
-        return None
-
     # Prioridad de URL: qr.url -> vcard.portfolio
     url = (qr_cfg.get("url") or "").strip()
     if not url:
@@ -677,24 +1117,52 @@ def ensure_portfolio_qr(cfg: dict, html_base_dir: Path) -> str | None:
     box_size = int(qr_cfg.get("box_size", 8))
     border = int(qr_cfg.get("border", 2))
 
+    memo_key = (str(html_base_dir), out_dir, filename, url, box_size, border)
+    cached = _QR_CACHE.get(memo_key)
+    if cached is not None and os.path.exists(cached[0]):
+        return cached[1]
+
     out_path = (html_base_dir / out_dir / filename).resolve()
-    out_path.parent.mkdir(parents=True, exist_ok=True)
+    ensure_dir(out_path.parent)
 
-    qr = qrcode.QRCode(
-        version=None,
-        error_correction=qrcode.constants.ERROR_CORRECT_M,
-        box_size=box_size,
-        border=border,
-    )
-    qr.add_data(url)
-    qr.make(fit=True)
+    rel_src = out_path.relative_to(html_base_dir)
+    rel_src = str(rel_src).replace("\\", "/")
+
+    # Cache: si el PNG ya existe para la misma (url, box_size, border, nivel M),
+    # no lo regeneramos (el encode del PNG es lo más caro del QR).
+    key = hashlib.sha1(f"{url}|{box_size}|{border}|M".encode("utf-8")).hexdigest()[:12]
+    key_path = out_path.with_suffix(".png.key")
+    try:
+        if out_path.exists() and key_path.read_text(encoding="utf-8").strip() == key:
+            _QR_CACHE[memo_key] = (out_path, rel_src)
+            return rel_src
+    except OSError:
+        pass
+
+    if qrcode is None:
+        print("[WARN] QR enabled pero falta 'qrcode'. Instala: pip install qrcode[pil]")
+        return None
+
+    if box_size == 10 and border == 4:
+        # Valores por defecto de la librería: atajo qrcode.make(...)
+        qrcode.make(url).save(out_path)
+    else:
+        qr = qrcode.QRCode(
+            version=None,
+            error_correction=qrcode.constants.ERROR_CORRECT_M,
+            box_size=box_size,
+            border=border,
+        )
+        qr.add_data(url)
+        qr.make(fit=True)
 
-    img = qr.make_image(fill_color="black", back_color="white")
-    img.save(out_path)
+        img = qr.make_image(fill_color="black", back_color="white")
+        img.save(out_path)
+
+    key_path.write_text(key, encoding="utf-8")
+    _QR_CACHE[memo_key] = (out_path, rel_src)
 
     # Devolvemos la ruta relativa para usarla en el HTML
-    rel_src = out_path.relative_to(html_base_dir)
-    rel_src = str(rel_src).replace("\\", "/")
     print(f"[OK] QR generado: {rel_src} -> {url}")
     return rel_src
 
@@ -721,90 +1189,382 @@ def inject_qr_placeholder(html: str, qr_src: str | None) -> str:
 # 7) CID: imágenes locales embebidas en el email
 # ============================================================
 
-def prepare_html_and_attachments(html: str, base_dir: Path):
-    """
-    Convierte imágenes locales del HTML a imágenes inline (CID):
-
-    - Busca <img src="...">
-    - Si src empieza con http/https/cid/data: -> NO se toca
-    - Si src es local -> se reemplaza por cid:xxxx
-    - Devuelve:
-        html_final (str)
-        inline_attachments (list[dict]) con:
-            path, maintype, subtype, filename, cid
+# <img ... src="..."> con comillas dobles o simples.
+# - Grupo 1: la comilla usada
+# - Grupo "src": la ruta tal cual está en la plantilla
+_IMG_SRC_RE = re.compile(r"""<img\b[^>]*?\ssrc\s*=\s*(["'])(?P<src>.*?)\1""", re.IGNORECASE)
 
-    Parámetros:
-      base_dir (Path):
-        - carpeta base para resolver rutas relativas de imágenes.
-        - normalmente es la carpeta donde está la plantilla HTML.
-    """
-    soup = BeautifulSoup(html, "html.parser")
-    inline_attachments = []
-    used = {}  # evita adjuntar duplicados si la misma imagen se repite
+# <img ... src=ruta> SIN comillas (solo se usa en el fallback)
+_IMG_SRC_UNQUOTED_RE = re.compile(r"""<img\b[^>]*?\ssrc\s*=\s*(?P<src>[^\s"'>]+)""", re.IGNORECASE)
 
-    for img in soup.find_all("img"):
-        src = img.get("src")
-        if not src:
-            continue
+# Parseo parcial con BeautifulSoup: solo etiquetas <img>
+_IMG_ONLY = SoupStrainer("img")
 
-        # Ya está remoto o ya es inline cid o base64 -> se deja como está
-        if src.startswith(("http://", "https://", "cid:", "data:")):
-            continue
+# src que NO se embeben (ya remotos, ya inline o base64).
+# Una sola definición para la regex y para el XPath de abajo.
+_REMOTE_SRC_PREFIXES = ("http://", "https://", "cid:", "data:")
 
-        img_path = Path(src)
-        if not img_path.is_absolute():
-            img_path = (base_dir / src).resolve()
+# Con lxml: los src locales (no http/https/cid/data) en 1 sola consulta en C
+_LOCAL_IMG_SRC_XPATH = "//img[@src{}]/@src".format(
+    "".join(f" and not(starts-with(@src,'{p}'))" for p in _REMOTE_SRC_PREFIXES)
+)
 
-        if not img_path.exists():
-            print(f"[WARN] Image not found, leaving as is: {src}")
-            continue
 
-        # Reutilizar CID si la imagen aparece varias veces
-        if src in used:
-            cid = used[src]["cid"]
-        else:
-            cid = make_msgid()  # retorna "<...>"
-            mime_type, _ = mimetypes.guess_type(str(img_path))
-            if mime_type is None:
-                maintype, subtype = "application", "octet-stream"
-            else:
-                maintype, subtype = mime_type.split("/", 1)
-
-            info = {
-                "cid": cid,
-                "path": img_path,
-                "maintype": maintype,
-                "subtype": subtype,
-                "filename": img_path.name,
-            }
-            inline_attachments.append(info)
-            used[src] = info
-            print(f"[OK] Embedded image {src} as CID {cid}")
+def parsed_img_srcs(html: str) -> set[str]:
+    """
+    Conjunto de src de <img> tal como los ve un parser HTML real.
+
+    - Con lxml: XPath sobre el árbol de lxml (sin pasar por bs4);
+      ya filtra los src remotos/cid/data.
+    - Sin lxml: BeautifulSoup + SoupStrainer("img").
+    """
+    if lxml_html is not None:
+        try:
+            return {str(src) for src in lxml_html.fromstring(html).xpath(_LOCAL_IMG_SRC_XPATH)}
+        except Exception:
+            pass  # HTML vacío/raro: que lo intente bs4
+    soup = BeautifulSoup(html, HTML_PARSER, parse_only=_IMG_ONLY)
+    return {img.get("src") for img in soup.find_all("img")}
+
+
+# Tipos fijos para las extensiones típicas de un email:
+# - No dependen de la base MIME del sistema (en algunos Windows/contenedores
+#   falta .webp o .svg, o .png viene mal registrado en el registro).
+_KNOWN_MIME = {
+    ".jpg": ("image", "jpeg"),
+    ".jpeg": ("image", "jpeg"),
+    ".png": ("image", "png"),
+    ".gif": ("image", "gif"),
+    ".webp": ("image", "webp"),
+    ".svg": ("image", "svg+xml"),
+    ".pdf": ("application", "pdf"),
+}
+
+
+@lru_cache(maxsize=128)
+def _guess_mime(suffix: str) -> tuple[str, str]:
+    """
+    (maintype, subtype) según la extensión (".png", ".pdf", ...).
+
+    Cacheado por extensión: mimetypes.guess_type recorre sus tablas
+    en cada llamada. Las extensiones de _KNOWN_MIME no consultan el sistema.
+    Sin tipo conocido -> application/octet-stream.
+    """
+    known = _KNOWN_MIME.get(suffix)
+    if known is not None:
+        return known
+
+    mime_type, _ = mimetypes.guess_type("x" + suffix)
+    if mime_type is None:
+        return "application", "octet-stream"
+    maintype, subtype = mime_type.split("/", 1)
+    return maintype, subtype
+
+
+# Firmas de cabecera (magic bytes) -> (maintype, subtype)
+_MAGIC_MIME = (
+    (b"\x89PNG\r\n\x1a\n", ("image", "png")),
+    (b"\xff\xd8\xff", ("image", "jpeg")),
+    (b"GIF87a", ("image", "gif")),
+    (b"GIF89a", ("image", "gif")),
+    (b"%PDF-", ("application", "pdf")),
+)
+
+
+def _sniff_mime(head: bytes) -> tuple[str, str] | None:
+    """(maintype, subtype) según los primeros bytes del archivo, o None."""
+    for magic, mime in _MAGIC_MIME:
+        if head.startswith(magic):
+            return mime
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "image", "webp"
+    return None
+
+
+@lru_cache(maxsize=128)
+def _file_mime(path_str: str, mtime_ns: int) -> tuple[str, str]:
+    """
+    (maintype, subtype) de un archivo: primero por extensión y, si eso
+    da application/octet-stream (sin extensión / extensión rara), por
+    sus primeros 16 bytes.
+
+    Nota:
+      - octet-stream hace que muchos clientes no muestren la imagen inline.
+      - Cacheado por (ruta, mtime): la cabecera se lee 1 vez por archivo.
+    """
+    mime = _guess_mime(os.path.splitext(path_str)[1].lower())
+    if mime != ("application", "octet-stream"):
+        return mime
+    try:
+        with open(path_str, "rb") as f:
+            sniffed = _sniff_mime(f.read(16))
+    except OSError:
+        sniffed = None
+    return sniffed or mime
+
+
+# Cache de imágenes locales ya resueltas:
+#   (base_dir, src) -> (mtime_ns, {"path", "maintype", "subtype", "filename"})
+# - En un envío a N destinatarios con la misma plantilla, cada <img>
+#   se resuelve (resolve + mimetype) UNA vez, no N veces.
+# - Solo se guardan imágenes encontradas: si falta, se reintenta
+#   en el siguiente envío (por si aparece después).
+# - Cada acierto hace 1 stat: si la imagen se borró (worker de larga
+#   duración) la entrada se descarta; si cambió, se vuelve a resolver.
+_IMG_INFO_CACHE: dict[tuple[str, str], tuple[int, dict]] = {}
+
+
+def resolve_inline_image(base_dir: Path, src: str) -> dict | None:
+    """
+    Resuelve un src local de <img> a su archivo y tipo MIME.
+
+    Retorna:
+      dict con path, maintype, subtype, filename
+      o None si el archivo no existe.
+    """
+    key = (str(base_dir), src)
+    cached = _IMG_INFO_CACHE.get(key)
+    if cached is not None:
+        img_path = cached[1]["path"]
+    else:
+        img_path = Path(src)
+        if not img_path.is_absolute():
+            img_path = Path(os.path.abspath(base_dir / src))
+
+    try:
+        mtime_ns = img_path.stat().st_mtime_ns
+    except OSError:
+        _IMG_INFO_CACHE.pop(key, None)
+        return None
+
+    if cached is not None and cached[0] == mtime_ns:
+        return cached[1]
+
+    maintype, subtype = _file_mime(str(img_path), mtime_ns)
+
+    info = {
+        "path": img_path,
+        "maintype": maintype,
+        "subtype": subtype,
+        "filename": img_path.name,
+    }
+    _IMG_INFO_CACHE[key] = (mtime_ns, info)
+    return info
+
+
+def prepare_html_and_attachments(html: str, base_dir: Path):
+    """
+    Convierte imágenes locales del HTML a imágenes inline (CID):
+
+    - Busca <img src="..."> con una regex precompilada (sin construir DOM)
+    - Si quedan <img> que la regex no entiende (src sin comillas),
+      se validan con un parser real (XPath de lxml o bs4, ver parsed_img_srcs)
+    - Si src empieza con http/https/cid/data: -> NO se toca
+    - Si src es local -> se reemplaza por cid:xxxx
+    - Devuelve:
+        html_final (str)
+        inline_attachments (list[dict]) con:
+            path, maintype, subtype, filename, cid
+
+    Parámetros:
+      base_dir (Path):
+        - carpeta base para resolver rutas relativas de imágenes.
+        - normalmente es la carpeta donde está la plantilla HTML.
+
+    Nota:
+      - Solo se reescribe el valor de src; el resto del HTML sale
+        exactamente igual que en la plantilla.
+    """
+    inline_attachments = []
+    used = {}  # evita adjuntar duplicados si la misma imagen se repite
+    used_by_path = {}  # ruta absoluta -> info (mismo archivo con otro src)
+
+    # Sin <img> no hay nada que embeber -> ni siquiera pasamos la regex
+    if "<img" not in html.lower():
+        return html, inline_attachments
+
+    def _cid_for(src: str) -> str | None:
+        """CID (sin "<>") para un src local, o None si no se debe tocar."""
+        if not src:
+            return None
+
+        # Ya está remoto o ya es inline cid o base64 -> se deja como está
+        if src.startswith(_REMOTE_SRC_PREFIXES):
+            return None
+
+        # Reutilizar CID si la imagen aparece varias veces
+        if src in used:
+            return used[src]["cid"][1:-1]
+
+        resolved = resolve_inline_image(base_dir, src)
+        if resolved is None:
+            print(f"[WARN] Image not found, leaving as is: {src}")
+            return None
+
+        # Mismo archivo con otro src ("img/a.png", "./img/a.png", ruta absoluta...):
+        # se reutiliza el CID en vez de adjuntar una 2ª copia
+        path_key = str(resolved["path"])
+        if path_key in used_by_path:
+            used[src] = used_by_path[path_key]
+            return used[src]["cid"][1:-1]
+
+        cid = make_msgid()  # retorna "<...>"
+        info = {"cid": cid, **resolved}
+        inline_attachments.append(info)
+        used[src] = info
+        used_by_path[path_key] = info
+        print(f"[OK] Embedded image {src} as CID {cid}")
 
         # EmailMessage espera cid sin "<>"
-        img["src"] = f"cid:{cid[1:-1]}"
+        return cid[1:-1]
 
-    return str(soup), inline_attachments
+    matched = 0  # cuántos <img> entrecomillados vio la regex
 
+    def _repl(m: re.Match) -> str:
+        nonlocal matched
+        matched += 1
+        tag = m.group(0)
+        cid = _cid_for(m.group("src"))
+        if cid is None:
+            return tag
 
-def attach_related_images(html_part, attachments):
+        # Cortamos el tag justo antes del valor de src y cerramos con la misma comilla.
+        return tag[:m.start("src") - m.start()] + f"cid:{cid}" + m.group(1)
+
+    html_final = _IMG_SRC_RE.sub(_repl, html)
+
+    # Fallback: hay <img> que la regex no reconoció (p.ej. src sin comillas).
+    # El parser solo sirve para validar qué src ve realmente; la reescritura
+    # se sigue haciendo por regex sobre el string original (no se serializa
+    # el árbol, así el resto del HTML no cambia).
+    if matched < html.lower().count("<img"):
+        parsed_srcs = parsed_img_srcs(html_final)
+
+        def _repl_unquoted(m: re.Match) -> str:
+            tag = m.group(0)
+            src = m.group("src")
+            if src not in parsed_srcs:
+                return tag
+            cid = _cid_for(src)
+            if cid is None:
+                return tag
+            return tag[:m.start("src") - m.start()] + f"cid:{cid}"
+
+        html_final = _IMG_SRC_UNQUOTED_RE.sub(_repl_unquoted, html_final)
+
+    # Si ningún src se reescribió (todo remoto / no encontrado),
+    # devolvemos la plantilla original tal cual.
+    if not used:
+        return html, inline_attachments
+    return html_final, inline_attachments
+
+
+# Cache en memoria de payloads base64:
+#   ruta -> (mtime_ns, payload_base64)
+# - Si el archivo no cambió, el siguiente envío NO lo vuelve a leer
+#   ni a codificar (el email module lo re-codificaba en cada mensaje).
+# - Una entrada por ruta: si el archivo cambia, se reemplaza.
+_B64_CACHE: dict[str, tuple[int, str]] = {}
+
+# A partir de este tamaño, el archivo se codifica desde un mmap
+# (no se copia entero al heap de Python antes del base64)
+MMAP_THRESHOLD = 1 << 20  # 1 MB
+
+
+def encoded_file_payload(path: Path) -> str:
     """
-    Adjunta cada imagen inline como "related" del HTML part.
+    Devuelve el contenido del archivo ya codificado en base64
+    (líneas de 76 caracteres, listo para Content-Transfer-Encoding: base64).
 
-    Esto es lo que hace que en Gmail se vea la imagen dentro del email
-    sin depender de links externos.
+    Usa _B64_CACHE validando por mtime: solo lee/codifica si el archivo cambió.
     """
-    for att in attachments:
-        with open(att["path"], "rb") as f:
-            data = f.read()
+    path = Path(path)
+    st = path.stat()
+    mtime = st.st_mtime_ns
+    key = str(path)
+
+    cached = _B64_CACHE.get(key)
+    if cached is not None and cached[0] == mtime:
+        return cached[1]
+
+    if st.st_size >= MMAP_THRESHOLD:
+        # Archivos grandes (PDFs pesados): base64 lee directo de las páginas
+        # mapeadas; no hay un bytes crudo del tamaño del archivo en memoria
+        with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            payload = base64.encodebytes(mm).decode("ascii")
+    else:
+        data = path.read_bytes()
+        payload = base64.encodebytes(data).decode("ascii")
+        del data  # liberamos los bytes crudos antes de seguir con el siguiente archivo
+
+    _B64_CACHE[key] = (mtime, payload)
+    return payload
+
+
+def make_encoded_part(payload_b64: str, maintype: str, subtype: str, filename: str, cid: str | None = None) -> EmailMessage:
+    """
+    Construye una parte MIME con un payload base64 YA codificado.
+
+    Genera los mismos headers que add_related/add_attachment:
+      Content-Type, Content-Transfer-Encoding: base64,
+      Content-Disposition: attachment; filename=..., Content-ID (si hay cid)
+    """
+    part = EmailMessage()
+    part["Content-Type"] = f"{maintype}/{subtype}"
+    part["Content-Transfer-Encoding"] = "base64"
+    part.add_header("Content-Disposition", "attachment", filename=filename)
+    if cid:
+        part["Content-ID"] = cid
+    part.set_payload(payload_b64)
+    return part
+
+
+def make_related_parts(attachments) -> list[EmailMessage]:
+    """
+    Crea las partes MIME (base64) de las imágenes inline.
+
+    Retorna:
+      list[EmailMessage] listas para html_part.attach(...)
 
-        html_part.add_related(
-            data,
+    Nota:
+      - El base64 sale de _B64_CACHE: no se re-codifica la misma imagen.
+      - Las partes se pueden reutilizar en varios mensajes (build_shared_payload).
+    """
+    return [
+        make_encoded_part(
+            encoded_file_payload(att["path"]),
             maintype=att["maintype"],
             subtype=att["subtype"],
-            cid=att["cid"],
             filename=att["filename"],
+            cid=att["cid"],
         )
+        for att in attachments
+    ]
+
+
+def attach_related_parts(html_part, parts) -> None:
+    """
+    Añade partes ya construidas como "related" del HTML part.
+    """
+    if not parts:
+        return
+
+    # Igual que add_related: el HTML pasa a ser multipart/related
+    if html_part.get_content_type() != "multipart/related":
+        html_part.make_related()
+
+    for part in parts:
+        html_part.attach(part)
+
+
+def attach_related_images(html_part, attachments):
+    """
+    Adjunta cada imagen inline como "related" del HTML part.
+
+    Esto es lo que hace que en Gmail se vea la imagen dentro del email
+    sin depender de links externos.
+    """
+    attach_related_parts(html_part, make_related_parts(attachments))
 
 
 # ============================================================
@@ -829,19 +1589,18 @@ def load_file_attachments_from_config(cfg: dict, adjuntos_dir: Path | None = Non
 
     file_attachments = []
     for name in filenames:
-        path = (adjuntos_dir / name).resolve()
-        if not path.exists():
+        # abspath: solo manipula el string (resolve() hace stat/readlink)
+        path = Path(os.path.abspath(adjuntos_dir / name))
+        try:
+            mtime_ns = path.stat().st_mtime_ns  # 1 stat: existe + mtime
+        except OSError:
             print(f"[WARN] Attachment not found: {path}")
             continue
 
-        mime_type, _ = mimetypes.guess_type(str(path))
-        if mime_type is None:
-            maintype, subtype = "application", "octet-stream"
-        else:
-            maintype, subtype = mime_type.split("/", 1)
+        maintype, subtype = _file_mime(str(path), mtime_ns)
 
         file_attachments.append(
-            {"path": path, "maintype": maintype, "subtype": subtype, "filename": path.name}
+            {"path": path, "maintype": maintype, "subtype": subtype, "filename": path.name, "mtime_ns": mtime_ns}
         )
         print(f"[OK] Prepared file attachment: {path.name}")
 
@@ -852,16 +1611,25 @@ def attach_files(msg: EmailMessage, file_attachments):
     """
     Adjunta archivos como attachments normales al EmailMessage.
     Ejemplo: tu CV en PDF.
+
+    Nota:
+      - El base64 sale de _B64_CACHE (ver encoded_file_payload):
+        el mismo PDF no se vuelve a leer ni a codificar en cada envío.
     """
     for att in file_attachments:
-        with open(att["path"], "rb") as f:
-            data = f.read()
-
-        msg.add_attachment(
-            data,
-            maintype=att["maintype"],
-            subtype=att["subtype"],
-            filename=att["filename"],
+        payload = encoded_file_payload(att["path"])
+
+        # Igual que add_attachment: el mensaje pasa a ser multipart/mixed
+        if msg.get_content_type() != "multipart/mixed":
+            msg.make_mixed()
+
+        msg.attach(
+            make_encoded_part(
+                payload,
+                maintype=att["maintype"],
+                subtype=att["subtype"],
+                filename=att["filename"],
+            )
         )
 
 
@@ -869,6 +1637,7 @@ def attach_files(msg: EmailMessage, file_attachments):
 # 9) vCard (.vcf)
 # ============================================================
 
+@lru_cache(maxsize=4)
 def build_vcard(
     full_name: str,
     title: str,
@@ -886,6 +1655,7 @@ def build_vcard(
 
     Nota:
       - La vCard te permite que el receptor te guarde como contacto en 1 click.
+      - Memoizada (lru_cache): con la misma config los bytes se generan una vez.
     """
     lines = [
         "BEGIN:VCARD",
@@ -941,39 +1711,190 @@ def attach_vcard(msg: EmailMessage, cfg: dict) -> None:
 # 10) Construcción del EmailMessage final (por destinatario)
 # ============================================================
 
-def create_message_for_recipient(cfg: dict, recipient: str, theme_index_override: int | None = None) -> EmailMessage:
-    """
-    Construye el EmailMessage completo para 1 destinatario.
+# Plantillas de mensaje ya construidas (adjuntos + vCard), por firma.
+_TEMPLATE_MSG_CACHE: dict[str, EmailMessage] = {}
 
-    Incluye:
-      - Headers (From/To/Subject)
-      - Texto plano (y PS opcional)
-      - HTML (PS + QR + Theme + CID inline)
+
+def build_template_message(cfg: dict) -> EmailMessage:
+    """
+    Construye (una vez) la parte del email que NO depende del destinatario:
       - Adjuntos normales (PDF)
       - vCard
 
+    Retorna:
+      EmailMessage multipart/mixed que solo contiene esos adjuntos.
+
+    Memoización:
+      - La firma incluye email.from, la config de vcard y (ruta, mtime)
+        de cada adjunto. Si nada cambió, se devuelve la MISMA plantilla.
+      - assemble_message() comparte estas partes por referencia en cada
+        mensaje: base64, headers y vCard se generan una sola vez.
+    """
+    email_cfg = cfg.get("email", {})
+    file_attachments = load_file_attachments_from_config(cfg, BASE_DIR / "adjuntos")
+
+    signature = json.dumps(
+        {
+            "from": email_cfg.get("from", ""),
+            "vcard": cfg.get("vcard", {}),
+            "files": [(str(a["path"]), a["mtime_ns"]) for a in file_attachments],
+        },
+        sort_keys=True,
+        ensure_ascii=False,
+    )
+    cached = _TEMPLATE_MSG_CACHE.get(signature)
+    if cached is not None:
+        return cached
+
+    template_msg = EmailMessage()
+    template_msg.make_mixed()
+
+    # 4) Adjuntos normales (PDFs)
+    attach_files(template_msg, file_attachments)
+
+    # 5) vCard
+    attach_vcard(template_msg, cfg)
+
+    if len(_TEMPLATE_MSG_CACHE) >= 8:
+        _TEMPLATE_MSG_CACHE.clear()
+    _TEMPLATE_MSG_CACHE[signature] = template_msg
+    return template_msg
+
+
+def build_shared_payload(cfg: dict, template: str | None = None) -> dict:
+    """
+    Prepara UNA vez todo lo que comparten los destinatarios de un lote.
+
+    Incluye:
+      - HTML de la plantilla con el QR inyectado (sin PS ni theme)
+      - Partes MIME de los adjuntos + vCard (build_template_message)
+      - Caché por theme del HTML con theme + imágenes locales en cid:
+        (themed_html_and_parts; se llena al construir cada mensaje)
+
     Parámetros:
-      recipient (str): email destino
-      theme_index_override (int|None):
-        - si viene (por cola), fuerza theme estable y no cambia por strategy
+      template (str|None): plantilla HTML a usar; None = cfg["email"]["html_template"]
 
     Retorna:
-      EmailMessage listo para send_message(...)
+      dict con:
+        html (str), base_dir (Path), file_parts (list), themed (dict)
+
+    Nota:
+      - send_now/send_bulk lo llaman antes del bucle: plantilla, QR,
+        regex de <img> y base64 pasan de N veces a 1 (por theme).
+      - Las partes se comparten por referencia entre mensajes
+        (los CIDs de las imágenes se repiten en todo el lote).
+      - Cada parte lleva su caché de bytes (_flat_cache): SharedPartGenerator
+        serializa los base64 UNA vez y el resto de mensajes copia los bytes.
     """
     email_cfg = cfg["email"]
 
-    # 1) Elegimos un PS por correo (si está activado)
-    ps_line = pick_random_ps(cfg)
+    # Resolvemos la plantilla relativa a BASE_DIR para que funcione desde cualquier cwd.
+    html_template_path = resolve_under_base(str(template or email_cfg["html_template"]))
+
+    # base_dir es la carpeta de la plantilla (para resolver imágenes/QR)
+    base_dir = html_template_path.parent
+
+    html_raw = load_html_template(html_template_path)
+
+    # Generar QR + rellenar placeholder si existe
+    qr_src = ensure_portfolio_qr(cfg, base_dir)
+    html_raw = inject_qr_placeholder(html_raw, qr_src)
+
+    file_parts = list(build_template_message(cfg).iter_attachments())
+    for part in file_parts:
+        part._flat_cache = {}
+
+    return {
+        "html": html_raw,
+        "base_dir": base_dir,
+        "file_parts": file_parts,
+        "themed": {},
+    }
+
+
+def themed_html_and_parts(shared: dict, theme_idx: int | None, theme: dict | None) -> tuple[str, list]:
+    """
+    HTML con el theme aplicado y las imágenes locales ya en cid:,
+    más sus partes MIME inline. Se calcula 1 vez por theme y lote.
+
+    Retorna:
+      (html_cid, inline_parts)
+
+    Nota:
+      - El theme va ANTES de la conversión a CID (mismo orden que siempre):
+        si un theme cambia la ruta de una imagen, se embebe la nueva.
+      - Con varios hilos (send_bulk) dos pueden calcular el mismo theme a
+        la vez: se queda el primero (setdefault) y cada mensaje usa un
+        par html/partes coherente.
+    """
+    key = theme_idx if theme is not None else None
+    cached = shared["themed"].get(key)
+    if cached is not None:
+        return cached
+
+    html_themed = apply_theme_to_html(shared["html"], theme)
+    html_cid, inline_attachments = prepare_html_and_attachments(html_themed, shared["base_dir"])
+    inline_parts = make_related_parts(inline_attachments)
+    for part in inline_parts:
+        part._flat_cache = {}
+
+    return shared["themed"].setdefault(key, (html_cid, inline_parts))
+
+
+@lru_cache(maxsize=32)
+def parsed_header(name: str, value: str):
+    """
+    Header ya parseado por email.policy (cacheado por nombre + valor).
+
+    Nota:
+      - msg["From"] = str pasa por el parser de email.policy en cada mensaje.
+      - Si se asigna un header YA parseado con el mismo nombre, EmailMessage
+        lo guarda tal cual: From/Subject se parsean 1 vez por lote.
+      - Cachear por valor (y no en el payload compartido) respeta los
+        subject override de la cola.
+    """
+    return email_policy.default.header_factory(name, value)
+
+
+def assemble_message(
+    shared: dict,
+    cfg: dict,
+    recipient: str,
+    theme_index_override: int | None = None,
+    ps_line: str | None = None,
+    subject: str | None = None
+) -> EmailMessage:
+    """
+    Construye el mensaje de 1 destinatario a partir de build_shared_payload().
+
+    Solo se genera aquí lo que cambia por destinatario:
+      - Headers (To, X-Original-To, X-Theme-*, X-PS-Line)
+      - Texto plano (y PS opcional)
+      - HTML (PS) sobre el HTML con theme del lote (themed_html_and_parts)
+
+    Las imágenes inline y los adjuntos se añaden por referencia
+    (no se copian ni se vuelven a codificar).
+
+    Parámetros:
+      ps_line (str|None): PS ya elegido (precompute_ps_lines); None = elegir aquí
+      subject (str|None): asunto a usar; None = cfg["email"]["subject"]
+                          (el worker pasa aquí el subject del job, sin tocar cfg)
+    """
+    email_cfg = cfg["email"]
+
+    # 1) Elegimos un PS por correo (si está activado y no viene ya elegido)
+    if ps_line is None:
+        ps_line = pick_random_ps(cfg)
 
     # 2) Elegimos theme según config (o override si viene de queue)
     theme_idx, theme = resolve_theme(cfg, recipient, theme_index_override)
 
     # 3) EmailMessage base
     msg = EmailMessage()
-    msg["From"] = email_cfg["from"]
+    msg["From"] = parsed_header("From", email_cfg["from"])
     msg["To"] = recipient
     msg["X-Original-To"] = recipient  # útil para logs/depuración
-    msg["Subject"] = email_cfg["subject"]
+    msg["Subject"] = parsed_header("Subject", subject or email_cfg["subject"])
 
     # Headers de depuración: saber qué theme se aplicó realmente
     if theme is not None:
@@ -988,51 +1909,27 @@ def create_message_for_recipient(cfg: dict, recipient: str, theme_index_override
     msg.set_content(body_text)
 
     # ---------------------------
-    # 2) HTML TEMPLATE
+    # 2) HTML (theme + CID, 1 vez por theme; el PS por destinatario)
     # ---------------------------
-    # Resolvemos la plantilla relativa a BASE_DIR para que funcione desde cualquier cwd.
-    html_template_path = Path(email_cfg["html_template"])
-    if not html_template_path.is_absolute():
-        html_template_path = (BASE_DIR / html_template_path)
-    html_template_path = html_template_path.resolve()
-
-    # base_dir es la carpeta de la plantilla (para resolver imágenes/QR)
-    base_dir = html_template_path.parent
-
-    html_raw = load_html_template(html_template_path)
-
-    # 2.1) Insertar PS al HTML (si está habilitado)
-    html_raw = apply_ps_to_html(html_raw, ps_line, cfg)
-
-    # 2.2) Generar QR + rellenar placeholder si existe
-    qr_src = ensure_portfolio_qr(cfg, base_dir)
-    html_raw = inject_qr_placeholder(html_raw, qr_src)
-
-    # 2.3) Aplicar theme (reemplazos de strings)
-    html_raw = apply_theme_to_html(html_raw, theme)
-
-    # 2.4) Convertir imágenes locales a CID (inline)
-    html_final, inline_attachments = prepare_html_and_attachments(html_raw, base_dir)
+    html_cid, inline_parts = themed_html_and_parts(shared, theme_idx, theme)
+    html_final = apply_ps_to_html(html_cid, ps_line, cfg, theme)
 
     # ---------------------------
-    # 3) MULTIPART: HTML alternative
+    # 3) MULTIPART: HTML alternative + imágenes inline
     # ---------------------------
     msg.add_alternative(html_final, subtype="html")
 
     # el html_part suele ser el último payload
     html_part = msg.get_payload()[-1]
-    attach_related_images(html_part, inline_attachments)
-
-    # ---------------------------
-    # 4) Adjuntos normales (PDFs)
-    # ---------------------------
-    file_attachments = load_file_attachments_from_config(cfg, BASE_DIR / "adjuntos")
-    attach_files(msg, file_attachments)
+    attach_related_parts(html_part, inline_parts)
 
     # ---------------------------
-    # 5) vCard
+    # 4) + 5) Adjuntos comunes (PDF + vCard)
     # ---------------------------
-    attach_vcard(msg, cfg)
+    if shared["file_parts"]:
+        msg.make_mixed()
+        for part in shared["file_parts"]:
+            msg.attach(part)
 
     # Header extra para depurar el PS que tocó (si existe)
     if ps_line:
@@ -1041,10 +1938,377 @@ def create_message_for_recipient(cfg: dict, recipient: str, theme_index_override
     return msg
 
 
+def create_message_for_recipient(
+    cfg: dict,
+    recipient: str,
+    theme_index_override: int | None = None,
+    subject: str | None = None,
+    template: str | None = None
+) -> EmailMessage:
+    """
+    Construye el EmailMessage completo para 1 destinatario.
+
+    Incluye:
+      - Headers (From/To/Subject)
+      - Texto plano (y PS opcional)
+      - HTML (PS + QR + Theme + CID inline)
+      - Adjuntos normales (PDF)
+      - vCard
+
+    Parámetros:
+      recipient (str): email destino
+      theme_index_override (int|None):
+        - si viene (por cola), fuerza theme estable y no cambia por strategy
+      subject / template (str|None):
+        - overrides del job; None = los de cfg["email"] (cfg no se modifica)
+
+    Retorna:
+      EmailMessage listo para send_message(...)
+
+    Nota:
+      - Para 1 solo correo (worker). En lotes, usa build_shared_payload()
+        una vez + assemble_message() por destinatario.
+    """
+    shared = build_shared_payload(cfg, template)
+    return assemble_message(shared, cfg, recipient, theme_index_override, subject=subject)
+
+
+# ============================================================
+# 11) Conexión SMTP reutilizable (una sola por lote)
+# ============================================================
+
+@cache
+def _ssl_ctx() -> ssl.SSLContext:
+    """
+    SSLContext por defecto, creado una sola vez por proceso.
+
+    Nota:
+      - create_default_context() carga el almacén de CAs del sistema (caro).
+      - Un SSLContext de cliente se puede compartir entre conexiones/hilos.
+    """
+    return ssl.create_default_context()
+
+
+class SharedPartGenerator(BytesGenerator):
+    """
+    BytesGenerator que reutiliza los bytes de las partes compartidas.
+
+    Nota:
+      - Las partes de build_shared_payload (imágenes inline, PDFs, vCard)
+        son las mismas en todo el lote y son lo más pesado del mensaje.
+      - La 1ª vez se serializan normal y se guardan por linesep en
+        part._flat_cache; después solo se copian los bytes.
+      - El resto (headers, texto, HTML con PS/theme, boundaries) se genera
+        por mensaje como siempre.
+    """
+
+    def flatten(self, msg, unixfrom=False, linesep=None):
+        cache = getattr(msg, "_flat_cache", None)
+        if cache is None:
+            return super().flatten(msg, unixfrom, linesep)
+
+        key = linesep or self.policy.linesep
+        raw = cache.get(key)
+        if raw is None:
+            buf = BytesIO()
+            # Llamada directa a la base: la parte es hoja (no hay sub-partes)
+            BytesGenerator.flatten(self.clone(buf), msg, unixfrom, linesep)
+            raw = cache[key] = buf.getvalue()
+        self._fp.write(raw)
+
+
+def message_bytes(msg: EmailMessage) -> bytes:
+    """
+    Serializa el mensaje para SMTP (CRLF) igual que smtplib.send_message.
+
+    Retorna:
+      bytes listos para sendmail(...)
+    """
+    buf = BytesIO()
+    SharedPartGenerator(buf, mangle_from_=False, policy=msg.policy).flatten(msg, linesep="\r\n")
+    return buf.getvalue()
+
+
+def envelope_addrs(msg: EmailMessage) -> tuple[str, list[str]] | None:
+    """
+    Remitente y destinatarios del sobre SMTP (mismas reglas que send_message).
+
+    Retorna:
+      (from_addr, to_addrs) o None si el mensaje necesita send_message:
+        - headers Resent-* o Bcc (send_message los trata aparte)
+        - direcciones no ASCII (SMTPUTF8)
+    """
+    if msg.get_all("Resent-Date") is not None or msg["Bcc"] is not None:
+        return None
+
+    from_addr = getaddresses([str(msg["Sender"] or msg["From"])])[0][1]
+    fields = [str(f) for f in (msg["To"], msg["Cc"]) if f is not None]
+    to_addrs = [a[1] for a in getaddresses(fields)]
+
+    if not all(a.isascii() for a in (from_addr, *to_addrs)):
+        return None
+    return from_addr, to_addrs
+
+
+class SMTPDeliveryUnknown(smtplib.SMTPException):
+    """
+    La conexión se cortó DURANTE el DATA (p.ej. tras enviar el mensaje y
+    antes del 250): el servidor pudo haberlo aceptado.
+
+    No se reintenta (evita duplicados); el caller lo registra como error
+    para poder revisarlo a mano.
+    """
+
+
+class SmtpSender:
+    """
+    Mantiene UNA conexión SMTP autenticada y la reutiliza para varios envíos.
+
+    Antes se abría una conexión nueva por correo (EHLO + STARTTLS + LOGIN
+    en cada envío). El handshake TLS + auth es lo más lento de mandar un
+    email pequeño, así que ahora se hace una vez por lote.
+
+    Uso:
+      with SmtpSender(cfg["smtp"]) as smtp:
+          smtp.send(msg1)
+          smtp.send(msg2)
+
+    Config (cfg["smtp"]):
+      host, port, user, password, use_tls (igual que antes)
+      max_per_connection (default 5000):
+        - tras N envíos se reconecta (muchos proveedores limitan
+          los mensajes por conexión)
+      idle_check_seconds (default 60):
+        - si la conexión lleva más de N segundos sin usarse (p.ej. el
+          worker con rate_limit), se hace NOOP antes de enviar; si el
+          servidor ya la cerró, se reconecta
+
+    Nota:
+      - La conexión se abre en el primer send(), así un fallo de red
+        se registra como error del destinatario (igual que antes).
+      - Se envía con sendmail(bytes) (ver message_bytes): los adjuntos
+        compartidos no se vuelven a serializar en cada mensaje.
+      - Solo se reintenta un corte ANTES del DATA. Si se corta durante
+        el DATA se lanza SMTPDeliveryUnknown (sin reintento).
+    """
+
+    def __init__(self, smtp_cfg: dict):
+        self.host = smtp_cfg["host"]
+        self.port = int(smtp_cfg["port"])
+        self.user = smtp_cfg["user"]
+        self.password = smtp_cfg["password"]
+        self.use_tls = smtp_cfg.get("use_tls", True)
+        self.max_per_connection = int(smtp_cfg.get("max_per_connection", 5000))
+        self.idle_check_seconds = float(smtp_cfg.get("idle_check_seconds", 60))
+
+        self.server = None
+        self.sent = 0
+        self.last_used = 0.0
+        self.in_data = False  # True desde que el envío actual llegó al DATA
+
+    def connect(self) -> None:
+        """
+        Abre la conexión y hace login según el puerto (mismas ramas de siempre):
+          - 587 + use_tls -> SMTP + STARTTLS
+          - 465           -> SMTP_SSL directo
+          - otro          -> SMTP “simple”
+        """
+        # Gmail típico: 587 + STARTTLS
+        if self.use_tls and self.port == 587:
+            context = _ssl_ctx()
+            server = smtplib.SMTP(self.host, self.port)
+            server.ehlo_or_helo_if_needed()
+            server.starttls(context=context)
+            # Tras STARTTLS smtplib olvida el EHLO: login() lo repite solo
+            # (ehlo_or_helo_if_needed), así no hay un EHLO de más.
+
+        # Gmail SSL directo: 465
+        elif self.port == 465:
+            context = _ssl_ctx()
+            server = smtplib.SMTP_SSL(self.host, self.port, context=context)
+
+        # Fallback: SMTP “simple”
+        else:
+            server = smtplib.SMTP(self.host, self.port)
+
+        try:
+            server.login(self.user, self.password)
+        except Exception:
+            server.close()
+            raise
+
+        # sendmail/send_message llaman a server.data(): marcamos cuándo empieza
+        # (un corte a partir de ahí ya no es seguro reintentarlo)
+        data = server.data
+
+        def tracked_data(msg):
+            self.in_data = True
+            return data(msg)
+
+        server.data = tracked_data
+
+        self.server = server
+        self.sent = 0
+        self.last_used = time.monotonic()
+
+    def is_alive(self) -> bool:
+        """NOOP al servidor: True si la conexión sigue abierta."""
+        if self.server is None:
+            return False
+        try:
+            return self.server.noop()[0] == 250
+        except (smtplib.SMTPException, OSError):
+            return False
+
+    def close(self) -> None:
+        """Cierra la conexión (QUIT). Si ya estaba caída, no revienta."""
+        if self.server is None:
+            return
+        try:
+            self.server.quit()
+        except Exception:
+            self.server.close()
+        self.server = None
+
+    def _transmit(self, msg: EmailMessage, raw: bytes | None) -> None:
+        """sendmail con los bytes ya generados; send_message si no hay (raw=None)."""
+        if raw is None:
+            self.server.send_message(msg)
+        else:
+            from_addr, to_addrs = envelope_addrs(msg)
+            self.server.sendmail(from_addr, to_addrs, raw)
+
+    def send(self, msg: EmailMessage) -> None:
+        """
+        Envía un EmailMessage por la conexión abierta.
+
+        - Conecta en el primer envío.
+        - Recicla la conexión al llegar a max_per_connection.
+        - Si el servidor cortó la conexión (SMTPServerDisconnected) o
+          respondió un error temporal 4xx (p.ej. 421), reconecta y
+          reintenta UNA vez. Si vuelve a fallar, se propaga el error.
+        - Si el corte llega durante el DATA, NO se reintenta: el mensaje
+          pudo entregarse y saldría duplicado -> SMTPDeliveryUnknown.
+        """
+        if self.server is not None and self.sent >= self.max_per_connection:
+            self.close()
+
+        # Conexión ociosa mucho rato: comprobamos que siga viva
+        if (
+            self.server is not None
+            and time.monotonic() - self.last_used > self.idle_check_seconds
+            and not self.is_alive()
+        ):
+            self.close()
+
+        if self.server is None:
+            self.connect()
+
+        # Serializamos 1 vez (también sirve para el reintento)
+        raw = message_bytes(msg) if envelope_addrs(msg) is not None else None
+
+        self.in_data = False
+        try:
+            self._transmit(msg, raw)
+        except (smtplib.SMTPServerDisconnected, smtplib.SMTPResponseException) as e:
+            # 5xx = error permanente: reintentar no sirve
+            if isinstance(e, smtplib.SMTPResponseException) and not 400 <= e.smtp_code < 500:
+                raise
+            if isinstance(e, smtplib.SMTPServerDisconnected) and self.in_data:
+                self.server = None
+                raise self._delivery_unknown(e) from e
+            print(f"[WARN] SMTP connection lost or busy ({e}); reconnecting and retrying once")
+            self.close()
+            self.connect()
+            self.in_data = False
+            try:
+                self._transmit(msg, raw)
+            except smtplib.SMTPServerDisconnected as e2:
+                self.server = None
+                if self.in_data:
+                    raise self._delivery_unknown(e2) from e2
+                raise
+
+        self.sent += 1
+        self.last_used = time.monotonic()
+
+    @staticmethod
+    def _delivery_unknown(e: Exception) -> SMTPDeliveryUnknown:
+        """Error para un corte durante el DATA (mensaje quizá entregado)."""
+        return SMTPDeliveryUnknown(
+            f"Connection lost during DATA ({e}); the message may have been "
+            "delivered, not retrying"
+        )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
 # ============================================================
-# 11) Envío inmediato (send_now)
+# 12) Envío inmediato (send_now) y envío en paralelo (send_bulk)
 # ============================================================
 
+def send_one(
+    cfg: dict,
+    smtp: SmtpSender,
+    recipient: str,
+    shared: dict | None = None,
+    ps_line: str | None = None
+) -> tuple[str, str, bool, str]:
+    """
+    Construye y envía el correo de 1 destinatario por la conexión dada.
+
+    Parámetros:
+      shared (dict|None): resultado de build_shared_payload(cfg) del lote.
+        - Si es None, se prepara solo para este correo.
+      ps_line (str|None): PS precalculado del lote (None = elegir aquí).
+
+    Retorna:
+      (recipient, subject, success, info) -> listo para log_email_result(cfg, *res)
+
+    Nota:
+      - No escribe el log: así el caller lo hace desde un solo hilo.
+    """
+    # Construimos el mensaje final para este destinatario
+    if shared is None:
+        shared = build_shared_payload(cfg)
+    msg = assemble_message(shared, cfg, recipient, ps_line=ps_line)
+    return deliver_message(smtp, recipient, msg)
+
+
+def deliver_message(smtp: SmtpSender, recipient: str, msg: EmailMessage) -> tuple[str, str, bool, str]:
+    """
+    Envía un mensaje YA construido y arma el resultado para el log.
+
+    Retorna:
+      (recipient, subject, success, info) -> listo para log_email_result(cfg, *res)
+    """
+    # Datos útiles para el log
+    subject_for_log = msg["Subject"]
+    ps_for_log = msg.get("X-PS-Line", "")
+    theme_for_log = msg.get("X-Theme-Name", "")
+
+    try:
+        smtp.send(msg)
+    except Exception as e:
+        err = str(e)
+        print(f"[ERROR] Sending email failed to {recipient}: {err}")
+        return recipient, subject_for_log, False, err
+
+    print(f"[OK] Email enviado a {recipient}")
+
+    extra = "Sent successfully (with vCard + QR)"
+    if theme_for_log:
+        extra += f" | THEME={theme_for_log}"
+    if ps_for_log:
+        extra += f" | PS={ps_for_log}"
+
+    return recipient, subject_for_log, True, extra
+
+
 def send_now(cfg: dict) -> None:
     """
     Envía inmediatamente a todos los destinatarios en email.to.
@@ -1052,6 +2316,11 @@ def send_now(cfg: dict) -> None:
     Nota:
       - Si email.to es lista, manda N correos (1 por destinatario).
       - Si email.to es string, manda 1 correo.
+      - Todos los correos salen por la MISMA conexión SMTP (SmtpSender).
+      - Si smtp.concurrency > 1, se reparte entre esa cantidad de
+        conexiones en paralelo (send_bulk).
+      - Con 1 conexión, el siguiente mensaje se construye en otro hilo
+        mientras se envía el actual.
     """
     smtp_cfg = cfg["smtp"]
     recipients = get_recipients(cfg)
@@ -1059,70 +2328,89 @@ def send_now(cfg: dict) -> None:
         print("[ERROR] No hay destinatario en email.to")
         return
 
-    host = smtp_cfg["host"]
-    port = int(smtp_cfg["port"])
-    user = smtp_cfg["user"]
-    password = smtp_cfg["password"]
-    use_tls = smtp_cfg.get("use_tls", True)
+    concurrency = int(smtp_cfg.get("concurrency", 1))
+    if concurrency > 1 and len(recipients) > 1:
+        send_bulk(cfg, recipients, workers=min(concurrency, len(recipients)))
+        return
 
-    for recipient in recipients:
-        # Construimos el mensaje final para este destinatario
-        msg = create_message_for_recipient(cfg, recipient)
+    # Plantilla, QR, CIDs y adjuntos: una sola vez para todo el lote
+    shared = build_shared_payload(cfg)
 
-        # Datos útiles para el log
-        subject_for_log = msg["Subject"]
-        ps_for_log = msg.get("X-PS-Line", "")
-        theme_for_log = msg.get("X-Theme-Name", "")
+    ps_lines = precompute_ps_lines(cfg, len(recipients))
 
-        try:
-            # Gmail típico: 587 + STARTTLS
-            if use_tls and port == 587:
-                context = ssl.create_default_context()
-                with smtplib.SMTP(host, port) as server:
-                    server.ehlo()
-                    server.starttls(context=context)
-                    server.ehlo()
-                    server.login(user, password)
-                    server.send_message(msg)
-
-            # Gmail SSL directo: 465
-            elif port == 465:
-                context = ssl.create_default_context()
-                with smtplib.SMTP_SSL(host, port, context=context) as server:
-                    server.login(user, password)
-                    server.send_message(msg)
-
-            # Fallback: SMTP “simple”
-            else:
-                with smtplib.SMTP(host, port) as server:
-                    server.login(user, password)
-                    server.send_message(msg)
-
-            print(f"[OK] Email enviado a {recipient}")
-
-            extra = "Sent successfully (with vCard + QR)"
-            if theme_for_log:
-                extra += f" | THEME={theme_for_log}"
-            if ps_for_log:
-                extra += f" | PS={ps_for_log}"
-
-            log_email_result(cfg, recipient, subject_for_log, True, extra)
-
-        except Exception as e:
-            err = str(e)
-            print(f"[ERROR] Sending email failed to {recipient}: {err}")
-            log_email_result(cfg, recipient, subject_for_log, False, err)
+    # Pipeline de 1 hilo: mientras el correo i viaja por SMTP (la red
+    # libera el GIL), el hilo "builder" arma el i+1. Un solo builder
+    # mantiene el orden de construcción (round_robin igual que en serie).
+    with SmtpSender(smtp_cfg) as smtp, ThreadPoolExecutor(max_workers=1) as builder:
+        nxt = builder.submit(assemble_message, shared, cfg, recipients[0], ps_line=ps_lines[0])
+        for i, recipient in enumerate(recipients):
+            msg = nxt.result()
+            if i + 1 < len(recipients):
+                nxt = builder.submit(assemble_message, shared, cfg, recipients[i + 1], ps_line=ps_lines[i + 1])
+            log_email_result(cfg, *deliver_message(smtp, recipient, msg))
+
+    # Fin del lote: volcamos el log pendiente y el rr_next de los themes
+    flush_log()
+    flush_templates_state()
+
+
+def send_bulk(cfg: dict, recipients: list[str], workers: int = 4) -> None:
+    """
+    Envía a muchos destinatarios en paralelo con K conexiones SMTP.
+
+    Cómo funciona:
+      - ThreadPoolExecutor con `workers` hilos.
+      - Cada hilo tiene SU propio SmtpSender (threading.local), abierto
+        en su primer envío y reutilizado para el resto.
+      - SmtpSender ya recicla la conexión cada smtp.max_per_connection.
+      - Los resultados se recogen con as_completed y el log se escribe
+        desde el hilo principal (buffer de log sin concurrencia).
+
+    Nota:
+      - K conexiones ≈ K× throughput hasta que el proveedor limite
+        (Gmail corta si abres demasiadas a la vez: usa pocos workers).
+    """
+    if not recipients:
+        print("[ERROR] No hay destinatarios para send_bulk")
+        return
+
+    smtp_cfg = cfg["smtp"]
+    shared = build_shared_payload(cfg)  # se prepara antes de lanzar los hilos
+    local = threading.local()
+    senders: list[SmtpSender] = []
+    senders_lock = threading.Lock()
+
+    def _task(recipient: str, ps_line: str):
+        smtp = getattr(local, "smtp", None)
+        if smtp is None:
+            smtp = SmtpSender(smtp_cfg)
+            local.smtp = smtp
+            with senders_lock:
+                senders.append(smtp)
+        return send_one(cfg, smtp, recipient, shared, ps_line)
+
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, int(workers))) as pool:
+            ps_lines = precompute_ps_lines(cfg, len(recipients))
+            futures = [pool.submit(_task, r, ps) for r, ps in zip(recipients, ps_lines)]
+            for fut in as_completed(futures):
+                log_email_result(cfg, *fut.result())
+    finally:
+        for smtp in senders:
+            smtp.close()
+        flush_log()
+        flush_templates_state()
 
 
 # ============================================================
-# 12) Schedule (solo encola y sale)
+# 13) Schedule (solo encola y sale)
 # ============================================================
 
 def schedule_only(cfg: dict) -> None:
     """
     NO envía correos.
 
-    Solo encola jobs en queue.json con:
+    Solo encola jobs (en queue.jsonl, que se lee junto a queue.json) con:
       - to
       - scheduled_for (ISO)
       - subject / template
@@ -1139,11 +2427,11 @@ def schedule_only(cfg: dict) -> None:
 
     scheduled_iso = parse_scheduled_for(cfg)
 
-    q = load_queue(cfg)
-    jobs = q.get("jobs", [])
-    if not isinstance(jobs, list):
-        jobs = []
+    # Mismo instante de creación para todo el lote (1 sola llamada a now_local)
+    created_at = now_local(cfg).isoformat()
+    email_cfg = cfg.get("email", {})
 
+    new_jobs = []
     for r in recipients:
         # Elegimos theme en el momento de encolar (para que luego sea consistente)
         theme_idx, theme = resolve_theme(cfg, r, None)
@@ -1154,26 +2442,30 @@ def schedule_only(cfg: dict) -> None:
             "to": r,
             "scheduled_for": scheduled_iso,
             "status": "pending",
-            "created_at": now_local(cfg).isoformat(),
-            "subject": cfg.get("email", {}).get("subject", ""),
-            "template": cfg.get("email", {}).get("html_template", ""),
+            "created_at": created_at,
+            "subject": email_cfg.get("subject", ""),
+            "template": email_cfg.get("html_template", ""),
             "theme_index": theme_idx,
             "theme_name": theme_name,
             "note": "Encolado desde config (modo schedule)"
         }
 
-        jobs.append(job)
+        new_jobs.append(job)
         print(f"[OK] Encolado: {r} @ {scheduled_iso} | THEME={theme_name}")
 
-    q["jobs"] = jobs
-    save_queue(cfg, q)
+    flush_templates_state()
+
+    # Append-only: no se lee ni se reescribe queue.json
+    lines = append_jobs(cfg, new_jobs)
+    if lines > int(get_app_cfg(cfg).get("queue_compact_lines", 1000)):
+        compact_queue(cfg)
 
     print(f"[INFO] Cola guardada en: {get_queue_path(cfg)}")
     (print("[INFO] (modo schedule) No se envió ningún correo. Solo se encoló."))
 
 
 # ============================================================
-# 13) MAIN: carga config.json y ejecuta modo
+# 14) MAIN: carga config.json y ejecuta modo
 # ============================================================
 
 if __name__ == "__main__":
@@ -16,11 +16,14 @@
 #   - Este worker es solo el "reloj" que ejecuta envíos cuando toca.
 # ============================================================
 
+import heapq
 import json
+import os
+import random
+import signal
+import sys
 import time
-import ssl
-import smtplib
-import importlib.util
+from functools import lru_cache
 from pathlib import Path
 from datetime import datetime, timedelta
 
@@ -36,6 +39,17 @@ except ImportError:
     ZoneInfo = None
 
 
+# ------------------------------------------------------------
+# JSON rápido (pip install orjson)
+# - La cola se lee y se reescribe en cada tick: orjson (C) es
+#   bastante más rápido que json. Si no está, usamos json.
+# ------------------------------------------------------------
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
 # ============================================================
 # BASE DIR
 # - Para que rutas relativas funcionen aunque ejecutes el worker
@@ -45,7 +59,7 @@ BASE_DIR = Path(__file__).resolve().parent
 
 
 # ============================================================
-# Cargar tu script 010 como módulo (aunque tenga espacios)
+# Cargar el script principal como módulo
 # ------------------------------------------------------------
 # ¿Por qué lo hacemos así?
 #  - El script ya sabe construir el EmailMessage completo
@@ -54,26 +68,31 @@ BASE_DIR = Path(__file__).resolve().parent
 #
 # Importante:
 #  - Esto permite mantener una sola fuente de verdad del email.
+#  - Import normal (BASE_DIR en sys.path): Python reutiliza el .pyc
+#    de __pycache__ en cada arranque del worker.
 # ============================================================
 SENDER_SCRIPT = BASE_DIR / "pierodev_email_sender.py"
 
 if not SENDER_SCRIPT.exists():
     raise FileNotFoundError(f"No existe el script 010 en: {SENDER_SCRIPT}")
 
-spec = importlib.util.spec_from_file_location("sender010", str(SENDER_SCRIPT))
-sender = importlib.util.module_from_spec(spec)
-assert spec.loader is not None
-spec.loader.exec_module(sender)
+if str(BASE_DIR) not in sys.path:
+    sys.path.insert(0, str(BASE_DIR))
+
+import pierodev_email_sender as sender  # noqa: E402
 
 
 # ============================================================
 # Helpers: timezone y fecha local
 # ============================================================
 
+@lru_cache(maxsize=8)
 def safe_tz(tz_name: str):
     """
     Intenta devolver ZoneInfo(tz_name).
     Si no hay ZoneInfo o no existe la zona -> None.
+
+    Cacheado por nombre (también el None de una zona inválida).
     """
     if ZoneInfo is None:
         return None
@@ -95,6 +114,21 @@ def now_local(cfg: dict) -> datetime:
     return datetime.now(tz) if tz else datetime.now()
 
 
+def make_now(cfg: dict):
+    """
+    Resuelve la timezone del config 1 sola vez y devuelve una función
+    sin argumentos equivalente a now_local(cfg).
+
+    Nota:
+      - El loop del worker la llama en cada tick y en cada envío:
+        así no recorre cfg["app"] ni consulta el cache de zonas cada vez.
+    """
+    tz = safe_tz(cfg.get("app", {}).get("timezone", "Europe/Madrid"))
+    if tz is None:
+        return datetime.now
+    return lambda: datetime.now(tz)
+
+
 # ============================================================
 # Helpers: ruta, lectura y guardado de queue.json
 # ============================================================
@@ -114,37 +148,129 @@ def queue_path(cfg: dict) -> Path:
 
 def load_queue(qp: Path) -> dict:
     """
-    Carga la cola desde qp.
+    Carga la cola desde qp (+ los jobs añadidos en queue.jsonl).
     Si no existe, devuelve {"jobs": []}.
+
+    Si quedó un queue.journal de un tick que no llegó a guardar
+    (crash / Ctrl+C), se aplica encima.
     """
-    if not qp.exists():
-        return {"jobs": []}
-    with open(qp, "r", encoding="utf-8") as f:
-        return json.load(f)
+    data = sender.read_queue_file(qp)
+    apply_journal(qp, data)
+    return data
+
+
+def journal_path(qp: Path) -> Path:
+    """queue.json -> queue.journal (1 línea por job procesado en el tick)."""
+    return qp.with_suffix(".journal")
+
+
+def journal_job(handle, job: dict) -> None:
+    """
+    Añade el estado actual de 1 job al journal.
+
+    Es una línea pequeña (no toda la cola): así no reescribimos
+    queue.json después de cada envío. flush() la deja en el SO.
+    """
+    if orjson is not None:
+        line = orjson.dumps(job)
+    else:
+        line = json.dumps(job, ensure_ascii=False).encode("utf-8")
+    handle.write(line + b"\n")
+    handle.flush()
+
+
+def apply_journal(qp: Path, data: dict) -> None:
+    """
+    Aplica queue.journal sobre data["jobs"] (por id). Si no existe, no hace nada.
+    Una línea a medias al final (corte mientras se escribía) se ignora.
+    """
+    try:
+        raw = journal_path(qp).read_bytes()
+    except FileNotFoundError:
+        return
+
+    by_id = {j.get("id"): j for j in data.get("jobs", []) if isinstance(j, dict)}
+    for line in raw.splitlines():
+        try:
+            entry = orjson.loads(line) if orjson is not None else json.loads(line)
+        except ValueError:
+            continue
+        job = by_id.get(entry.get("id"))
+        if job is not None:
+            job.update(entry)
 
 
 def save_queue(qp: Path, data: dict) -> None:
     """
     Guarda la cola de forma segura:
-      - escribe en un .tmp
-      - luego reemplaza el archivo real
-    Esto reduce el riesgo de queue.json corrupto.
+      - escribe en un .tmp (con fsync)
+      - luego reemplaza el archivo real (y fsync de la carpeta)
+    Esto evita perder o corromper queue.json si se corta el proceso.
     """
-    qp.parent.mkdir(parents=True, exist_ok=True)
-    tmp = qp.with_suffix(".tmp")
-    with open(tmp, "w", encoding="utf-8") as f:
-        json.dump(data, f, ensure_ascii=False, indent=2)
-    tmp.replace(qp)
+    if orjson is not None:
+        payload = orjson.dumps(data, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS)
+    else:
+        payload = json.dumps(data, ensure_ascii=False, indent=2).encode("utf-8")
+    sender.atomic_write_bytes(qp, payload)
+
+
+def compact_journal(qp: Path, jobs: list, sig: tuple | None) -> None:
+    """
+    Vuelca la cola completa a queue.json y vacía queue.journal.
+
+    Parámetros:
+      jobs (list): jobs en memoria del worker (con los status al día)
+      sig (tuple|None): queue_signature() de cuando se leyeron esos jobs
+
+    Nota:
+      - Es la única reescritura completa de la cola en el worker: se hace
+        cada app.queue_compact_lines líneas de journal (y al parar con Ctrl+C),
+        no en cada tick.
+      - Si la cola cambió en disco desde la lectura (p.ej. schedule compactó
+        queue.jsonl dentro de queue.json y lo borró), NO se escribe la lista
+        en memoria tal cual: se relee la cola y se le aplican los status de
+        memoria por id. Así no se pierden los jobs nuevos.
+    """
+    if queue_signature(qp) != sig:
+        mem_by_id = {j.get("id"): j for j in jobs if isinstance(j, dict)}
+        data = load_queue(qp)
+        jobs = [
+            mem_by_id.get(j.get("id"), j) if isinstance(j, dict) else j
+            for j in data.get("jobs", [])
+        ]
+    save_queue(qp, {"jobs": jobs})
+    journal_path(qp).unlink(missing_ok=True)
+
+
+def queue_signature(qp: Path) -> tuple:
+    """
+    Firma barata de la cola: (mtime_ns, size) de queue.json y queue.jsonl.
+
+    Si no cambió desde la última lectura, el worker reutiliza los jobs y
+    el heap que ya tiene en memoria (no relee ni re-parsea la cola).
+    """
+    sig = []
+    for p in (qp, sender.get_queue_log_path(qp)):
+        try:
+            st = os.stat(p)
+            sig.append((st.st_mtime_ns, st.st_size))
+        except FileNotFoundError:
+            sig.append(None)
+    return tuple(sig)
 
 
 # ============================================================
 # Helpers: parse de scheduled_for y comparación "due"
 # ============================================================
 
+@lru_cache(maxsize=4096)
 def parse_job_dt(raw: str) -> datetime | None:
     """
     Convierte job["scheduled_for"] a datetime.
 
+    Cacheado por string: al releer la cola (schedule añadió jobs) los
+    scheduled_for que ya se vieron no se vuelven a parsear.
+
     Acepta:
       - ISO con offset: 2026-02-12T02:48:00+01:00
       - ISO naive:      2026-02-12T02:48:00
@@ -172,18 +298,55 @@ def parse_job_dt(raw: str) -> datetime | None:
         return None
 
 
-def is_due(job_dt: datetime, now_dt: datetime) -> bool:
+def job_heap_key(job_dt: datetime, tz) -> datetime:
+    """
+    Normaliza job_dt para poder ordenarlo en el heap junto al resto
+    (naive y aware no se pueden comparar entre sí).
+
+    Criterio (mezcla tz-aware / naive):
+      - sin timezone -> todo naive (hora de pared)
+      - con timezone -> un job naive se interpreta en esa zona
     """
-    Decide si un job está vencido (job_dt <= now_dt).
+    if tz is None:
+        return job_dt.replace(tzinfo=None)
+    if job_dt.tzinfo is None:
+        return job_dt.replace(tzinfo=tz)
+    return job_dt
+
 
-    Considera mezcla tz-aware / naive:
-      - Si uno tiene tz y el otro no, compara en naive para evitar TypeError.
+def build_due_heap(jobs: list, tz) -> tuple[list, bool]:
     """
-    if job_dt.tzinfo is None and now_dt.tzinfo is not None:
-        return job_dt <= now_dt.replace(tzinfo=None)
-    if job_dt.tzinfo is not None and now_dt.tzinfo is None:
-        return job_dt.replace(tzinfo=None) <= now_dt
-    return job_dt <= now_dt
+    Parsea scheduled_for 1 sola vez (al cargar la cola) y arma un heap
+    de (fecha, índice) con los jobs pending.
+
+    Los jobs sin 'to' o con fecha inválida se marcan failed aquí mismo.
+
+    Retorna:
+      (heap, changed) -> changed=True si se marcó algún job como failed
+    """
+    heap = []
+    changed = False
+    for idx, job in enumerate(jobs):
+        if job.get("status", "pending") != "pending":
+            continue
+
+        if not (job.get("to") or "").strip():
+            job["status"] = "failed"
+            job["last_error"] = "Missing 'to'"
+            changed = True
+            continue
+
+        job_dt = parse_job_dt(job.get("scheduled_for", ""))
+        if job_dt is None:
+            job["status"] = "failed"
+            job["last_error"] = "Invalid 'scheduled_for'"
+            changed = True
+            continue
+
+        heap.append((job_heap_key(job_dt, tz), idx))
+
+    heapq.heapify(heap)
+    return heap, changed
 
 
 # ============================================================
@@ -197,18 +360,26 @@ def bump_retry(cfg: dict, job: dict, err: str) -> None:
     Config:
       app.max_retries (default 2)
       app.retry_delay_seconds (default 300)
+      app.max_retry_delay (default 3600)
 
     Comportamiento:
       - attempts++ y last_error = err
       - si attempts > max_retries:
           status=failed + failed_at
       - si no:
-          reprograma scheduled_for = now + retry_delay
+          reprograma scheduled_for = now + delay (backoff exponencial
+          con "full jitter": aleatorio entre 0 y retry_delay * 2^(intento-1),
+          tope max_retry_delay)
           status vuelve a pending
+
+    Nota:
+      - El jitter evita que 20 jobs que fallaron a la vez (SMTP caído)
+        vuelvan todos en el mismo segundo.
     """
     app = cfg.get("app", {})
     max_retries = int(app.get("max_retries", 2))
     retry_delay = int(app.get("retry_delay_seconds", 300))
+    max_retry_delay = int(app.get("max_retry_delay", 3600))
 
     attempts = int(job.get("attempts", 0)) + 1
     job["attempts"] = attempts
@@ -219,7 +390,8 @@ def bump_retry(cfg: dict, job: dict, err: str) -> None:
         job["failed_at"] = now_local(cfg).isoformat()
         return
 
-    nxt = now_local(cfg) + timedelta(seconds=retry_delay)
+    base = min(retry_delay * (2 ** (attempts - 1)), max_retry_delay)
+    nxt = now_local(cfg) + timedelta(seconds=random.uniform(0, base))
     job["scheduled_for"] = nxt.isoformat()
     job["status"] = "pending"
 
@@ -233,7 +405,9 @@ def send_job(
     to_addr: str,
     subject_override: str | None = None,
     template_override: str | None = None,
-    theme_index_override: int | None = None
+    theme_index_override: int | None = None,
+    shared_cache: dict | None = None,
+    smtp=None
 ) -> None:
     """
     Envía 1 correo a 1 destinatario usando el constructor del 010.
@@ -243,70 +417,59 @@ def send_job(
       - template_override: fuerza una plantilla específica desde el job
       - theme_index_override: asegura que se use el mismo theme elegido al encolar
 
-    Nota importante:
-      - Modificamos cfg["email"] temporalmente y lo restauramos al final.
-      - Esto evita que un job afecte el siguiente.
-    """
-    smtp_cfg = cfg["smtp"]
-    host = smtp_cfg["host"]
-    port = int(smtp_cfg["port"])
-    user = smtp_cfg["user"]
-    password = smtp_cfg["password"]
-    use_tls = smtp_cfg.get("use_tls", True)
+    shared_cache (dict|None):
+      - plantilla -> build_shared_payload(cfg) ya preparado en este tick
+      - así varios jobs con la misma plantilla no repiten plantilla/QR/CIDs
 
-    email_cfg = cfg.get("email", {})
-    old_subject = email_cfg.get("subject", "")
-    old_template = email_cfg.get("html_template", "")
+    smtp (SmtpSender|None):
+      - conexión abierta del tick (se reutiliza entre jobs)
+      - si es None, se abre y se cierra solo para este envío
 
-    if subject_override:
-        email_cfg["subject"] = subject_override
-    if template_override:
-        email_cfg["html_template"] = template_override
+    Nota:
+      - Los overrides se pasan como parámetros al 010: cfg["email"]
+        no se modifica, así que es seguro compartir cfg entre hilos.
+    """
+    smtp_cfg = cfg["smtp"]
 
+    # Lo común (plantilla + QR + CIDs + adjuntos) se prepara 1 vez por plantilla
+    template_key = template_override or cfg.get("email", {}).get("html_template", "")
+    shared = shared_cache.get(template_key) if shared_cache is not None else None
+    if shared is None:
+        shared = sender.build_shared_payload(cfg, template_override)
+        if shared_cache is not None:
+            shared_cache[template_key] = shared
+
+    # Construcción del mensaje completa la hace el 010
+    msg = sender.assemble_message(
+        shared,
+        cfg,
+        to_addr,
+        theme_index_override=theme_index_override,
+        subject=subject_override
+    )
+
+    # Envío SMTP (misma conexión/login que usa el 010)
     try:
-        # Construcción del mensaje completa la hace el 010
-        msg = sender.create_message_for_recipient(
-            cfg,
-            to_addr,
-            theme_index_override=theme_index_override
-        )
-
-        # Envío SMTP
-        if use_tls and port == 587:
-            context = ssl.create_default_context()
-            with smtplib.SMTP(host, port) as server:
-                server.ehlo()
-                server.starttls(context=context)
-                server.ehlo()
-                server.login(user, password)
-                server.send_message(msg)
-
-        elif port == 465:
-            context = ssl.create_default_context()
-            with smtplib.SMTP_SSL(host, port, context=context) as server:
-                server.login(user, password)
-                server.send_message(msg)
-
+        if smtp is not None:
+            smtp.send(msg)
         else:
-            with smtplib.SMTP(host, port) as server:
-                server.login(user, password)
-                server.send_message(msg)
+            with sender.SmtpSender(smtp_cfg) as one_shot:
+                one_shot.send(msg)
+    except sender.SMTPDeliveryUnknown as e:
+        # Puede que haya llegado: lo dejamos en el log para revisarlo
+        sender.log_email_result(cfg, to_addr, msg["Subject"], False, str(e))
+        raise
 
-        # Log de éxito usando el logger del 010 (consistencia de logs)
-        extra = "Sent from worker (queue) | with vCard + QR"
-        theme = msg.get("X-Theme-Name", "")
-        if theme:
-            extra += f" | THEME={theme}"
-        ps = msg.get("X-PS-Line", "")
-        if ps:
-            extra += f" | PS={ps}"
+    # Log de éxito usando el logger del 010 (consistencia de logs)
+    extra = "Sent from worker (queue) | with vCard + QR"
+    theme = msg.get("X-Theme-Name", "")
+    if theme:
+        extra += f" | THEME={theme}"
+    ps = msg.get("X-PS-Line", "")
+    if ps:
+        extra += f" | PS={ps}"
 
-        sender.log_email_result(cfg, to_addr, msg["Subject"], True, extra)
-
-    finally:
-        # Restaurar valores originales para no contaminar próximos envíos
-        email_cfg["subject"] = old_subject
-        email_cfg["html_template"] = old_template
+    sender.log_email_result(cfg, to_addr, msg["Subject"], True, extra)
 
 
 # ============================================================
@@ -330,89 +493,150 @@ if __name__ == "__main__":
     qp = queue_path(cfg)
     tick = int(cfg.get("app", {}).get("tick_seconds", 5))                 # cada cuánto revisa la cola
     rate_limit = int(cfg.get("app", {}).get("rate_limit_seconds", 15))    # pausa entre envíos
+    now = make_now(cfg)                                                   # timezone resuelta 1 vez
+    compact_lines = int(cfg.get("app", {}).get("queue_compact_lines", 1000))  # journal -> queue.json
 
     print(f"[INFO] Worker activo. Cola: {qp}")
     print(f"[INFO] tick={tick}s | rate_limit={rate_limit}s | Ctrl+C para parar")
 
-    # Loop infinito del worker
-    while True:
-        # 1) Cargar jobs
-        q = load_queue(qp)
-        jobs = q.get("jobs", [])
-        if not isinstance(jobs, list):
-            jobs = []
-
-        now_dt = now_local(cfg)
-        changed = False  # si hubo cambios, guardamos al final
-
-        # 2) Ordenar jobs por scheduled_for (más antiguo primero)
-        def job_sort_key(j):
-            dt = parse_job_dt(j.get("scheduled_for", ""))
-            return dt or datetime.max
-
-        jobs.sort(key=job_sort_key)
-
-        # 3) Revisar jobs pendientes
-        for job in jobs:
-            if job.get("status", "pending") != "pending":
-                continue
-
-            # 3.1) Validar destinatario
-            to_addr = (job.get("to") or "").strip()
-            if not to_addr:
-                job["status"] = "failed"
-                job["last_error"] = "Missing 'to'"
-                changed = True
-                continue
-
-            # 3.2) Validar scheduled_for
-            job_dt = parse_job_dt(job.get("scheduled_for", ""))
-            if job_dt is None:
-                job["status"] = "failed"
-                job["last_error"] = "Invalid 'scheduled_for'"
-                changed = True
-                continue
-
-            # 3.3) Si aún no toca, saltamos
-            if not is_due(job_dt, now_dt):
-                continue
-
-            # 3.4) Overrides guardados en el job
-            subject_override = job.get("subject") or None
-            template_override = job.get("template") or None
-            theme_index_override = job.get("theme_index", None)
-
-            print(f"[DUE] {to_addr} (job={job.get('id')}) -> enviando...")
-
-            try:
-                # Intentar envío
-                send_job(cfg, to_addr, subject_override, template_override, theme_index_override)
+    # Estado en memoria entre ticks:
+    # - jobs + heap se rehacen solo si queue.json / queue.jsonl cambiaron
+    #   (p.ej. schedule añadió jobs); si no, cada tick solo mira heap[0]
+    # - Los resultados van a queue.journal (1 línea por job): queue.json
+    #   solo se reescribe al compactar (journal_lines >= compact_lines)
+    jobs = []
+    heap = []
+    sig = None
+    journal_lines = 0
+    last_send = None  # time.monotonic() del último envío (rate-limit entre ticks)
+
+    # SIGTERM (kill, systemd, docker stop) -> SystemExit: pasa por el finally
+    # de abajo igual que Ctrl+C y el journal se compacta en queue.json
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
 
-                # Marcar como enviado
-                job["status"] = "sent"
-                job["sent_at"] = now_local(cfg).isoformat()
-                job["last_error"] = ""
-                changed = True
+    # Loop infinito del worker
+    try:
+        while True:
+            now_dt = now()
+            changed = False  # cambios que no pasan por el journal (jobs inválidos)
 
-                print(f"[OK] Enviado a {to_addr} | THEME={job.get('theme_name','')}")
+            # 1) Cargar jobs (solo si la cola cambió en disco)
+            cur_sig = queue_signature(qp)
+            if cur_sig != sig:
+                q = load_queue(qp)
+                jobs = q.get("jobs", [])
+                if not isinstance(jobs, list):
+                    jobs = []
+                sig = cur_sig
 
-            except Exception as e:
-                # Si falla: reintento o failed definitivo
-                err = str(e)
-                print(f"[ERROR] Falló {to_addr}: {err}")
-                bump_retry(cfg, job, err)
-                changed = True
+                # 2) Heap por scheduled_for (más antiguo primero); se parsea 1 vez
+                heap, changed = build_due_heap(jobs, now_dt.tzinfo)
 
-            # Guardado inmediato tras cada intento:
-            # - si el worker se cierra/crashea, no pierdes progreso
-            save_queue(qp, {"jobs": jobs})
+            shared_cache = {}  # plantilla -> payload común (se rehace en cada tick)
+            retry = []         # jobs reprogramados: vuelven al heap al final del tick
 
-            # Rate-limit entre envíos
-            time.sleep(rate_limit)
+            # 1 conexión SMTP por tick: se abre en el primer envío y se
+            # reutiliza para el resto de jobs vencidos (NOOP si estuvo ociosa)
+            smtp = sender.SmtpSender(cfg["smtp"])
 
-        # 4) Guardar si hubo cambios generales
-        if changed:
-            save_queue(qp, {"jobs": jobs})
+            # Journal: se abre (append) con el primer envío del tick
+            journal = None
 
-        # 5) Esperar antes del siguiente ciclo
-        time.sleep(tick)
+            try:
+                # 3) Sacar del heap solo los jobs vencidos (el resto ni se mira)
+                #    Las claves ya están normalizadas a la tz de now_dt (job_heap_key):
+                #    basta un <= directo, sin comprobar naive/aware en cada job
+                while heap and heap[0][0] <= now_dt:
+                    _, idx = heapq.heappop(heap)
+                    job = jobs[idx]
+                    to_addr = job["to"].strip()
+
+                    # 3.1) Overrides guardados en el job
+                    subject_override = job.get("subject") or None
+                    template_override = job.get("template") or None
+                    theme_index_override = job.get("theme_index", None)
+
+                    # Rate-limit: solo esperamos lo que falte desde el último envío
+                    # (no hay pausa muerta tras el último job del tick, y la
+                    # separación se respeta también entre ticks)
+                    if last_send is not None:
+                        wait = rate_limit - (time.monotonic() - last_send)
+                        if wait > 0:
+                            time.sleep(wait)
+
+                    print(f"[DUE] {to_addr} (job={job.get('id')}) -> enviando...")
+
+                    try:
+                        # Intentar envío
+                        send_job(cfg, to_addr, subject_override, template_override, theme_index_override, shared_cache, smtp)
+
+                        # Marcar como enviado
+                        job["status"] = "sent"
+                        job["sent_at"] = now().isoformat()
+                        job["last_error"] = ""
+
+                        print(f"[OK] Enviado a {to_addr} | THEME={job.get('theme_name','')}")
+
+                    except sender.SMTPDeliveryUnknown as e:
+                        # Corte durante el DATA: reintentar podría duplicar el
+                        # correo, así que queda failed (revisar a mano)
+                        err = str(e)
+                        print(f"[WARN] {to_addr}: {err}")
+                        job["status"] = "failed"
+                        job["failed_at"] = now().isoformat()
+                        job["last_error"] = err
+
+                    except Exception as e:
+                        # Si falla: reintento o failed definitivo
+                        err = str(e)
+                        print(f"[ERROR] Falló {to_addr}: {err}")
+                        bump_retry(cfg, job, err)
+                        if job["status"] == "pending":
+                            retry.append((job_heap_key(parse_job_dt(job["scheduled_for"]), now_dt.tzinfo), idx))
+
+                    # Tras cada intento: 1 línea en queue.journal (no toda la cola)
+                    # - si el worker se cierra/crashea, no pierdes progreso
+                    #   (open_for_append cierra una última línea a medias de un crash)
+                    if journal is None:
+                        journal = sender.open_for_append(journal_path(qp))
+                    journal_job(journal, job)
+                    journal_lines += 1
+                    last_send = time.monotonic()
+            finally:
+                # Fin del tick (o Ctrl+C): cerramos la conexión si se llegó a abrir
+                smtp.close()
+                if journal is not None:
+                    journal.close()
+
+            for item in retry:
+                heapq.heappush(heap, item)
+
+            # 4) Compactar: reescribir queue.json solo cada compact_lines envíos
+            #    (o si se marcaron jobs inválidos, que no pasan por el journal)
+            if changed or journal_lines >= compact_lines:
+                compact_journal(qp, jobs, sig)
+                journal_lines = 0
+                # Forzamos relectura en el siguiente tick: la cola en disco es
+                # ahora la fuente de verdad (incluye lo que schedule añadiera)
+                sig = None
+
+            # Volcamos el log y el rr_next de este ciclo (el 010 los guarda en memoria)
+            sender.flush_log()
+            sender.flush_templates_state()
+
+            # 5) Esperar antes del siguiente ciclo: hasta el próximo job del heap,
+            #    como mucho tick segundos (para ver los jobs nuevos de schedule)
+            #    Mínimo 0.1 s: un reintento con jitter puede quedar a ~0 s y
+            #    el bucle no debe girar en vacío releyendo la firma de la cola
+            sleep_for = tick
+            if heap:
+                sleep_for = max(0.1, min(tick, (heap[0][0] - now()).total_seconds()))
+            time.sleep(sleep_for)
+    except KeyboardInterrupt:
+        print("[INFO] Worker detenido (Ctrl+C)")
+    finally:
+        # Al salir (Ctrl+C / SIGTERM) dejamos queue.json al día
+        # (si el proceso muere sin pasar por aquí, el journal se aplica al arrancar)
+        if journal_lines:
+            compact_journal(qp, jobs, sig)
+        sender.flush_log()